@@ -3,48 +3,159 @@
 # ─────────────────────────────────────────────────────────────────────────────
 # Same power, softer touch, now with predictive OOM prevention:
 #   • Videos already captioned are **left where they are** (silently skipped).
-#   • 30-second timeout per video with model reload on timeout
+#   • 30-second wall-clock generate budget per video (StoppingCriteria watchdog)
 #   • Smart OOM prediction based on previous failures
-#   • Preemptive scaling for videos likely to cause OOM
+#   • Preemptive scaling for videos likely to cause OOM or overflow the context
 #   • Progressive downscaling as fallback (90% -> 80% -> ... -> 25%)
-#   • Aggressive VRAM cleanup between videos for stability
-#   • Fixed processor kwargs handling
+#   • Batched generation: N videos share one padded `generate` call, grouped by shape
+#   • Probing + frame decoding for the next batch overlaps GPU inference
+#   • --fps sampling decodes in-process with PyAV (ffmpeg JPEG fallback)
+#   • BF16/FP16 weights, optional NF4 / int8 (bitsandbytes) or FP8 (torchao) language model
+#   • VRAM cleanup only on OOM recovery
+#   • Fast (torchvision-backed) image processor
+#   • --skip-blocks: drop a fraction of the middle decoder blocks for speed
+#   • --merge-sim: near-static frame pairs are merged before the vision tower
+#   • --num-gpus: one model per GPU, videos sharded across them
 # -----------------------------------------------------------------------------
 
 from __future__ import annotations
 
 import argparse
+import atexit
 import gc
+import importlib.util
 import json
+import math
+import os
+import re
 import shutil
-import signal
 import subprocess
 import sys
 import tempfile
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Sequence, Optional, Tuple
+from typing import Dict, Iterator, List, Sequence, Optional, Tuple
+
+# Read once when torch initialises CUDA, so it must precede `import torch` (this also
+# covers callers importing `caption()`): expandable segments grow in place instead
+# of fragmenting on the ever-changing visual-token counts
+os.environ.setdefault(
+    "PYTORCH_CUDA_ALLOC_CONF",
+    "expandable_segments:True,garbage_collection_threshold:0.8,max_split_size_mb:512",
+)
 
 import torch
+import torch.nn.functional as F
 from tqdm import tqdm
-from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
-
+from transformers import (
+    AutoProcessor,
+    BatchFeature,
+    BitsAndBytesConfig,
+    Qwen2VLForConditionalGeneration,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
+
+from PIL import Image  # qwen_vl_utils dependency
 from qwen_vl_utils import process_vision_info  # type: ignore
+from qwen_vl_utils.vision_process import (  # type: ignore
+    FRAME_FACTOR,
+    VIDEO_MAX_PIXELS,
+    VIDEO_MIN_PIXELS,
+    VIDEO_TOTAL_PIXELS,
+    smart_resize,
+)
+
+try:
+    import av  # type: ignore  # in-process decode for --fps sampling
+except ImportError:  # pragma: no cover
+    av = None
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import decord  # type: ignore  # NVDEC decode for the downscale fallback
+except ImportError:  # pragma: no cover
+    decord = None
 
 VIDEO_EXT = {".mp4", ".mkv", ".mov", ".avi", ".webm", ".flv", ".m4v"}
+_EXT_NO_DOT = {ext[1:] for ext in VIDEO_EXT}
 BANNER = "\033[1m\033[35m✨  Magix Oracle: unveiling stories inside pixels… (Predictive OOM)\033[0m"
 TIMEOUT_SECONDS = 30
 MIN_SCALE = 0.25  # Minimum 25% of original size
 SCALE_STEP = 0.1  # Reduce by 10% each time
+FLUSH_EVERY = 50  # JSONL captions buffered between flushes
+FRAME_BUCKET = 16  # Frame counts rounded up to this when grouping videos into a batch
+BATCH_TOKEN_BUDGET = 32768  # Padded visual tokens (rows × longest row) per generate call
+PREFETCH_DEPTH = 2  # Batches probed/decoded ahead of the one on the GPU
+BYTES_PER_PIXEL = 4096  # Rough VRAM cost of one frame pixel through vision tower + prefill
+MIN_FRAME_PIXELS = 128 * 28 * 28  # qwen_vl_utils' VIDEO_MIN_PIXELS
+PIXEL_BUCKET = 64 * 28 * 28  # Clamped max_pixels snap to 64-token steps (fewer compiled shapes)
+MAX_VIDEO_TOKENS = 32768 - 512  # Qwen2-VL context minus prompt + max_new_tokens headroom
+MAX_NEW_TOKENS = 128  # Caption length cap per video
 OOM_HISTORY_FILE = "oom_history.json"
+PROBE_CACHE_FILE = "probe_cache.json"
 
 
 class TimeoutError(Exception):
     pass
 
 
-def timeout_handler(signum, frame):
-    raise TimeoutError("Video processing timed out")
+class WallclockStopping(StoppingCriteria):
+    """Stops `generate` once `timeout` seconds of wall-clock time have passed.
+
+    Checked once per decode step; `fired` tells the caller the caption was cut short.
+    """
+
+    def __init__(self, timeout: float):
+        self.deadline = time.monotonic() + timeout
+        self.fired = False
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if time.monotonic() > self.deadline:
+            self.fired = True
+        return torch.full((input_ids.shape[0],), self.fired, dtype=torch.bool, device=input_ids.device)
+
+
+def generate_with_timeout(model, inputs, timeout: float) -> torch.Tensor:
+    """`model.generate` bounded by a wall-clock budget; raises TimeoutError when hit."""
+    watchdog = WallclockStopping(timeout)
+    # Weights are already 2-byte; autocast keeps the ops that would upcast
+    # (norm reductions, RoPE) in the same dtype on tensor cores
+    half = model.device.type == "cuda" and model.dtype in (torch.bfloat16, torch.float16)
+    with torch.inference_mode(), torch.autocast("cuda", dtype=model.dtype, enabled=half):
+        out_ids = model.generate(
+            **inputs, max_new_tokens=MAX_NEW_TOKENS, use_cache=True,
+            stopping_criteria=StoppingCriteriaList([watchdog]),
+        )
+    if watchdog.fired:
+        raise TimeoutError("Video processing timed out")
+    return out_ids
+
+
+# Conservative thresholds used until a metric has OOM history
+DEFAULT_THRESHOLDS = {
+    'file_size_mb': 500,  # 500MB
+    'total_pixels': 1920 * 1080 * 300,  # 1080p * 300 frames
+    'width': 1920,
+    'height': 1080,
+    'frame_count': 300,
+    'duration': 30.0
+}
+# (metric, label) pairs checked by predict_oom_risk
+RISK_METRICS = [
+    ('file_size_mb', 'file_size'),
+    ('total_pixels', 'total_pixels'),
+    ('width', 'width'),
+    ('height', 'height'),
+    ('frame_count', 'frame_count'),
+]
 
 
 class OOMPredictor:
@@ -53,69 +164,74 @@ class OOMPredictor:
     def __init__(self, history_file: Path):
         self.history_file = history_file
         self.oom_failures = []
+        # Smallest failing value per metric - kept up to date instead of rescanning history
+        self._min_failing: Dict[str, float] = {}
+        self._thresholds: Dict[str, float] = dict(DEFAULT_THRESHOLDS)
         self.load_history()
 
     def load_history(self):
         """Load OOM failure history from file."""
         if self.history_file.exists():
             try:
-                with open(self.history_file, 'r') as f:
-                    self.oom_failures = json.load(f)
+                self.oom_failures = load_json(self.history_file)
                 print(f"📊  Loaded {len(self.oom_failures)} OOM failure records")
             except Exception as e:
                 print(f"⚠️  Could not load OOM history: {e}")
                 self.oom_failures = []
+        for failure in self.oom_failures:
+            self._track(failure)
+        self._refresh_thresholds()
 
     def save_history(self):
-        """Save OOM failure history to file."""
+        """Save OOM failure history to file.
+
+        --num-gpus workers share the file: records other workers saved since this
+        one loaded are merged in first, and the write is atomic (temp + replace)
+        so a crash never leaves a truncated file behind.
+        """
+        tmp = self.history_file.with_suffix(f".{os.getpid()}.tmp")
         try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.oom_failures, f, indent=2)
+            if self.history_file.exists():
+                known = {(f.get('path'), f.get('timestamp')) for f in self.oom_failures}
+                for failure in load_json(self.history_file):
+                    if (failure.get('path'), failure.get('timestamp')) not in known:
+                        self.oom_failures.append(failure)
+                        self._track(failure)
+                self._refresh_thresholds()
+            tmp.write_bytes(dump_json(self.oom_failures, indent=True))
+            os.replace(tmp, self.history_file)
         except Exception as e:
             print(f"⚠️  Could not save OOM history: {e}")
 
     def record_oom_failure(self, video_info: Dict):
         """Record a new OOM failure."""
-        self.oom_failures.append({
+        failure = {
             **video_info,
             'timestamp': time.time()
-        })
+        }
+        self.oom_failures.append(failure)
+        self._track(failure)
+        self._refresh_thresholds()
         self.save_history()
         print(f"📝  Recorded OOM failure for {video_info.get('name', 'unknown')}")
 
-    def get_safe_thresholds(self) -> Dict[str, float]:
-        """Calculate safe thresholds based on OOM history."""
-        if not self.oom_failures:
-            # Conservative defaults if no history
-            return {
-                'file_size_mb': 500,  # 500MB
-                'total_pixels': 1920 * 1080 * 300,  # 1080p * 300 frames
-                'width': 1920,
-                'height': 1080,
-                'frame_count': 300,
-                'duration': 30.0
-            }
+    def _track(self, failure: Dict):
+        for metric in DEFAULT_THRESHOLDS:
+            value = failure.get(metric)
+            if value is not None and value < self._min_failing.get(metric, float('inf')):
+                self._min_failing[metric] = value
 
-        # Find the smallest values that caused OOM (most conservative)
-        thresholds = {}
-        for metric in ['file_size_mb', 'total_pixels', 'width', 'height', 'frame_count', 'duration']:
-            values = [f.get(metric, float('inf')) for f in self.oom_failures if f.get(metric) is not None]
-            if values:
-                # Use 80% of the smallest failing value as threshold
-                thresholds[metric] = min(values) * 0.8
-            else:
-                # Fallback defaults
-                defaults = {
-                    'file_size_mb': 500,
-                    'total_pixels': 1920 * 1080 * 300,
-                    'width': 1920,
-                    'height': 1080,
-                    'frame_count': 300,
-                    'duration': 30.0
-                }
-                thresholds[metric] = defaults[metric]
-
-        return thresholds
+    def _refresh_thresholds(self):
+        # Swapped in whole, so the prefetch threads never see a half-updated dict
+        self._thresholds = {
+            # Use 80% of the smallest failing value as threshold
+            metric: self._min_failing[metric] * 0.8 if metric in self._min_failing else default
+            for metric, default in DEFAULT_THRESHOLDS.items()
+        }
+
+    def get_safe_thresholds(self) -> Dict[str, float]:
+        """Safe thresholds from OOM history (defaults for metrics without failures)."""
+        return self._thresholds
 
     def predict_oom_risk(self, video_info: Dict) -> Tuple[bool, float, str]:
         """
@@ -124,28 +240,12 @@ class OOMPredictor:
         """
         thresholds = self.get_safe_thresholds()
 
-        risks = []
-
         # Check various risk factors
-        if video_info.get('file_size_mb', 0) > thresholds['file_size_mb']:
-            excess = video_info['file_size_mb'] / thresholds['file_size_mb']
-            risks.append(('file_size', excess))
-
-        if video_info.get('total_pixels', 0) > thresholds['total_pixels']:
-            excess = video_info['total_pixels'] / thresholds['total_pixels']
-            risks.append(('total_pixels', excess))
-
-        if video_info.get('width', 0) > thresholds['width']:
-            excess = video_info['width'] / thresholds['width']
-            risks.append(('width', excess))
-
-        if video_info.get('height', 0) > thresholds['height']:
-            excess = video_info['height'] / thresholds['height']
-            risks.append(('height', excess))
-
-        if video_info.get('frame_count', 0) > thresholds['frame_count']:
-            excess = video_info['frame_count'] / thresholds['frame_count']
-            risks.append(('frame_count', excess))
+        risks = [
+            (label, video_info[metric] / thresholds[metric])
+            for metric, label in RISK_METRICS
+            if video_info.get(metric, 0) > thresholds[metric]
+        ]
 
         if not risks:
             return False, 1.0, "safe"
@@ -167,64 +267,233 @@ class OOMPredictor:
 
 
 # ─── Utilities ──────────────────────────────────────────────────────────────
+def jsonl_line(record: Dict) -> bytes:
+    """One JSONL record as bytes (orjson when available, stdlib json otherwise)."""
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return (json.dumps(record) + "\n").encode("utf-8")
+
+
+def dump_json(obj, indent: bool = False) -> bytes:
+    """`obj` as JSON bytes (orjson when available, stdlib json otherwise)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode("utf-8")
+
+
+def load_json(path: Path):
+    """Parse a JSON file read as bytes (orjson when available)."""
+    data = path.read_bytes()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def fast_move(src: Path, dst: Path) -> None:
+    """Rename in place; copy + delete only when `dst` is on another filesystem.
+
+    Keep `--skip-dir` on the input's mount so parking a clip is a single rename.
+    """
+    try:
+        os.replace(src, dst)
+    except OSError:
+        shutil.move(str(src), dst)
+
+
+_PATH_FIELD = re.compile(rb'"path":\s*"((?:[^"\\]|\\.)*)"')
+
+
+def captioned_paths(jsonl_path: Path, chunk_size: int = 1 << 20) -> set[str]:
+    """Every `"path"` already in a JSONL output, scanned as bytes without parsing records."""
+    done: set[str] = set()
+    carry = b""
+    with open(jsonl_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            data = carry + chunk
+            if chunk:
+                # Only scan complete lines; the partial tail waits for the next chunk
+                cut = data.rfind(b"\n") + 1
+                data, carry = data[:cut], data[cut:]
+            for m in _PATH_FIELD.finditer(data):
+                raw = m.group(1)
+                try:
+                    # Escaped paths (ensure_ascii, backslashes) go through the JSON decoder
+                    done.add(json.loads(b'"' + raw + b'"') if b"\\" in raw else raw.decode("utf-8"))
+                except ValueError:
+                    pass
+            if not chunk:
+                return done
+
+
+def iter_videos(root: Path) -> Iterator[str]:
+    """Yield video paths under `root` (unordered) - scandir walk, no per-entry Path."""
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.rpartition('.')[2].lower() in _EXT_NO_DOT:
+                    yield entry.path
+
+
 def list_videos(root: Path) -> Sequence[Path]:
-    return sorted(p for p in root.rglob("*") if p.suffix.lower() in VIDEO_EXT)
+    # Sorted on plain strings so batches (and OOM history) are reproducible run to run
+    return [Path(p) for p in sorted(iter_videos(root))]
+
+
+# ffprobe results per video path - probing never changes during a run
+_VIDEO_INFO: Dict[str, Dict] = {}
+_FRAME_COUNTS: Dict[str, Optional[int]] = {}
+# Persistent across runs, keyed "path:mtime_ns:size" so edited files are re-probed
+_PROBE_CACHE: Dict[str, Dict] = {}
+
+
+def load_probe_cache(cache_file: Path) -> None:
+    """Seed the probe cache from a previous run's sidecar JSON."""
+    if cache_file.exists():
+        try:
+            _PROBE_CACHE.update(load_json(cache_file))
+            print(f"📊  Loaded {len(_PROBE_CACHE)} cached video probes")
+        except Exception as e:
+            print(f"⚠️  Could not load probe cache: {e}")
+
+
+def save_probe_cache(cache_file: Path) -> None:
+    """Write the probe cache (atomically, so a crash never leaves half a file)."""
+    tmp = cache_file.with_suffix(f".{os.getpid()}.tmp")  # GPU workers share the file
+    try:
+        tmp.write_bytes(dump_json(dict(_PROBE_CACHE)))
+        os.replace(tmp, cache_file)
+    except Exception as e:
+        print(f"⚠️  Could not save probe cache: {e}")
 
 
 def get_video_info(video: Path) -> Dict:
-    """Get comprehensive video information."""
+    """Get comprehensive video information (memoized per path, cached on disk)."""
+    key = str(video)
+    if key in _VIDEO_INFO:
+        return _VIDEO_INFO[key]
+
+    stat = video.stat()
+    disk_key = f"{key}:{stat.st_mtime_ns}:{stat.st_size}"
+    if disk_key in _PROBE_CACHE:
+        _VIDEO_INFO[key] = _PROBE_CACHE[disk_key]
+        return _VIDEO_INFO[key]
+
     info = {
         'name': video.name,
         'path': str(video),
-        'file_size_mb': video.stat().st_size / (1024 * 1024),
+        'file_size_mb': stat.st_size / (1024 * 1024),
     }
 
     try:
-        # Get resolution, frame count, and duration
-        out = subprocess.check_output(
-            [
-                "ffprobe", "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "stream=width,height,nb_frames,duration",
-                "-of", "csv=p=0", str(video)
-            ],
-            stderr=subprocess.DEVNULL,
-            text=True,
-        )
+        header = _probe_header(video)
+        info['width'] = header['width']
+        info['height'] = header['height']
+        if header['duration']:
+            info['duration'] = header['duration']
+
+        frame_count = _frames_from_header(header)
+        if frame_count is None:
+            # Fallback: count frames manually
+            frame_count = _count_packets(video)
+            _FRAME_COUNTS[key] = frame_count
+        if frame_count:
+            info['frame_count'] = frame_count
+
+        # Calculate total pixels
+        if 'frame_count' in info:
+            info['total_pixels'] = info['width'] * info['height'] * info['frame_count']
 
-        parts = out.strip().split(',')
-        if len(parts) >= 2:
-            info['width'] = int(parts[0])
-            info['height'] = int(parts[1])
+    except Exception:
+        pass
 
-            # Try to get frame count (might not always work)
-            if len(parts) >= 3 and parts[2] and parts[2] != 'N/A':
-                info['frame_count'] = int(parts[2])
+    _VIDEO_INFO[key] = info
+    if 'width' in info:  # failed probes may be transient - retry them next run
+        _PROBE_CACHE[disk_key] = info
+    return info
+
+
+def _probe_header(video: Path) -> Dict:
+    """Header fields of the first video stream: width, height, nb_frames, duration, rate.
+
+    Read in-process with PyAV when installed (no subprocess), with ffprobe otherwise.
+    Fields the container doesn't record are None.
+    """
+    if av is not None:
+        with av.open(str(video)) as container:
+            stream = container.streams.video[0]
+            if stream.duration is not None and stream.time_base is not None:
+                duration = float(stream.duration * stream.time_base)
+            elif container.duration is not None:  # mkv/webm: only the container knows
+                duration = container.duration / av.time_base
             else:
-                # Fallback: count frames manually
-                frame_count = get_num_frames(video)
-                if frame_count:
-                    info['frame_count'] = frame_count
+                duration = None
+            return {
+                'width': stream.codec_context.width,
+                'height': stream.codec_context.height,
+                'nb_frames': stream.frames or None,
+                'duration': duration,
+                'rate': float(stream.average_rate) if stream.average_rate else None,
+            }
+
+    out = subprocess.check_output(
+        [
+            "ffprobe", "-v", "error", "-threads", "0",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=width,height,nb_frames,duration,avg_frame_rate:format=duration",
+            "-of", "json", str(video)
+        ],
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    probe = json.loads(out)
+    stream = probe["streams"][0]
+    # Stream duration is missing for mkv/webm; the container's is not
+    duration = stream.get('duration') or probe.get('format', {}).get('duration')
+    nb_frames = stream.get('nb_frames')
+    num, _, den = stream.get('avg_frame_rate', '0/0').partition('/')
+    return {
+        'width': int(stream['width']),
+        'height': int(stream['height']),
+        'nb_frames': int(nb_frames) if nb_frames and nb_frames != 'N/A' else None,
+        'duration': float(duration) if duration and duration != 'N/A' else None,
+        'rate': float(num) / float(den) if den and float(den) else None,
+    }
+
+
+def _frames_from_header(header: Dict) -> int | None:
+    """nb_frames, or duration × rate when the header has no count (None if neither)."""
+    if header['nb_frames']:
+        return header['nb_frames']
+    if header['duration'] and header['rate']:
+        return round(header['duration'] * header['rate'])
+    return None
 
-            # Duration
-            if len(parts) >= 4 and parts[3] and parts[3] != 'N/A':
-                info['duration'] = float(parts[3])
 
-            # Calculate total pixels
-            if 'frame_count' in info:
-                info['total_pixels'] = info['width'] * info['height'] * info['frame_count']
+def get_num_frames(video: Path) -> int | None:
+    """Frame count from the stream header, walking packets only if it is missing."""
+    key = str(video)
+    if key in _FRAME_COUNTS:
+        return _FRAME_COUNTS[key]
 
+    try:
+        frames = _frames_from_header(_probe_header(video))
     except Exception:
-        pass
+        frames = None
 
-    return info
+    if frames is None:  # nothing usable in the header - count packets
+        frames = _count_packets(video)
+    _FRAME_COUNTS[key] = frames
+    return frames
 
 
-def get_num_frames(video: Path) -> int | None:
+def _count_packets(video: Path) -> int | None:
+    """Exact frame count via `-count_packets` - reads the whole file."""
     try:
         out = subprocess.check_output(
             [
-                "ffprobe", "-v", "error",
+                "ffprobe", "-v", "error", "-threads", "0",
                 "-select_streams", "v:0",
                 "-count_packets",
                 "-show_entries", "stream=nb_read_packets",
@@ -260,98 +529,672 @@ def create_downscaled_video(video: Path, scale: float, tmp_dir: Path) -> Path:
     return scaled_video
 
 
-def extract_frames(video: Path, fps: float, tmp_dir: Path) -> List[str]:
+def gpu_downscale(video: Path, scale: float, fps: float | None) -> torch.Tensor:
+    """Decode with NVDEC and resize on the GPU → (T, C, H, W) uint8 on the CPU.
+
+    Replaces the libx264 re-encode + re-decode of `create_downscaled_video`.
+    """
+    decord.bridge.set_bridge("torch")
+    reader = decord.VideoReader(str(video), ctx=decord.gpu(0))
+    step = max(1, round(reader.get_avg_fps() / (fps or 1.0)))
+    indices = list(range(0, len(reader), step))
+    if len(indices) < 2:
+        indices = [0, len(reader) - 1]
+    # Qwen2-VL patches frames in temporal pairs
+    indices = indices[:len(indices) // 2 * 2]
+
+    frames = reader.get_batch(indices).permute(0, 3, 1, 2).float()
+    height, width = frames.shape[-2:]
+    size = (max(28, int(height * scale)), max(28, int(width * scale)))
+    frames = F.interpolate(frames, size=size, mode="bilinear", align_corners=False)
+    return frames.round_().clamp_(0, 255).to(torch.uint8).cpu()
+
+
+def extract_frames(video: Path, fps: float, tmp_dir: Path, scale: float = 1.0) -> List[str]:
+    """Sample frames to JPEGs with one ffmpeg call; the output count is the frame check."""
     tmp_dir.mkdir(parents=True, exist_ok=True)
     pattern = tmp_dir / "frame_%06d.jpg"
+    # Sampling and downscaling share one ffmpeg pass
+    vf = f"fps={fps}" if scale >= 1.0 else f"fps={fps},scale=iw*{scale}:ih*{scale}"
     subprocess.run(
         ["ffmpeg", "-hide_banner", "-loglevel", "error",
-         "-i", str(video), "-vf", f"fps={fps}", str(pattern)],
+         "-i", str(video), "-vf", vf, str(pattern)],
         check=True,
     )
-    return [f"file://{f.as_posix()}" for f in sorted(tmp_dir.glob("frame_*.jpg"))]
+    # ffmpeg numbers frames contiguously from 1 - no glob + sort needed
+    with os.scandir(tmp_dir) as it:
+        count = sum(1 for e in it if e.name.startswith("frame_"))
+    if count < 2:
+        raise ValueError(f"only {count} frame(s) at {fps} fps")
+    return [f"file://{(tmp_dir / f'frame_{i:06d}.jpg').as_posix()}" for i in range(1, count + 1)]
+
+
+def decode_frames(
+        video: Path, fps: float, max_pixels: int | None = None, scale: float = 1.0
+) -> List:
+    """Decode frames sampled at `fps` straight to RGB images with PyAV.
+
+    Skips the ffmpeg → JPEG on disk → JPEG decode round-trip of `extract_frames`.
+    With `max_pixels` or `scale` < 1, frames are scaled during the YUV→RGB conversion
+    (to the size qwen_vl_utils would resize them to), so full-res RGB copies are
+    never built - and a downscale needs no re-encoded temp file.
+    """
+    frames = []
+    step = 1.0 / fps
+    next_t = 0.0
+    size = {}
+    with av.open(str(video)) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        for frame in container.decode(stream):
+            if frame.time is not None:
+                if frame.time + 1e-6 < next_t:
+                    continue
+                next_t = frame.time + step
+            if not size and (max_pixels or scale < 1.0):
+                height = max(28, int(frame.height * scale))
+                width = max(28, int(frame.width * scale))
+                if max_pixels:
+                    height, width = smart_resize(height, width, max_pixels=max_pixels)
+                size = {"width": width, "height": height}
+            frames.append(frame.to_image(**size))
+    if len(frames) < 2:
+        raise ValueError(f"only {len(frames)} frame(s) at {fps} fps")
+    return frames
+
 
+# Identical in every message; shared rather than rebuilt (nothing downstream mutates it)
+_TEXT_PART = {"type": "text", "text": "Describe this video."}
 
-def build_message(video_path: Path, fps: float | None, max_pixels: int | None) -> Dict:
+
+def build_message(
+        video_path: Path,
+        fps: float | None,
+        max_pixels: int | None,
+        frames_dir: Path | None = None,
+        scale: float = 1.0,
+) -> Dict:
+    if fps is None and not max_pixels:
+        # Common path: only the URI varies
+        return {"role": "user", "content": [
+            {"type": "video", "video": f"file://{video_path.as_posix()}", "fps": 1.0}, _TEXT_PART
+        ]}
     if fps is not None:
-        tmp = Path(tempfile.mkdtemp())
-        uris = extract_frames(video_path, fps, tmp)
-        content = [{"type": "video", "video": uris, "fps": fps},
-                   {"type": "text", "text": "Describe this video."}]
+        if av is not None:
+            frames = decode_frames(video_path, fps, max_pixels, scale)
+        else:
+            frames = extract_frames(video_path, fps, frames_dir, scale)
+        content = [{"type": "video", "video": frames, "fps": fps,
+                    **({"max_pixels": max_pixels} if max_pixels else {})},
+                   _TEXT_PART]
     else:
         content = [{
             "type": "video",
             "video": f"file://{video_path.as_posix()}",
             **({"max_pixels": max_pixels} if max_pixels else {}),
             "fps": 1.0,
-        }, {"type": "text", "text": "Describe this video."}]
+        }, _TEXT_PART]
     return {"role": "user", "content": content}
 
 
-def aggressive_cleanup():
-    """Aggressive GPU memory cleanup."""
+def pick_max_pixels(width: int, height: int, free_bytes: int) -> int:
+    """Largest per-frame pixel count that fits in `free_bytes` of VRAM (never upscales)."""
+    return int(min(width * height, free_bytes // BYTES_PER_PIXEL))
+
+
+def frame_pixel_budget(
+        video_info: Dict,
+        max_pixels: int | None,
+        scale: float = 1.0,
+        share: int = 1,
+        free_bytes: int | None = None,
+) -> int | None:
+    """Per-frame `max_pixels` for Qwen: `scale`² of the source, capped by free VRAM.
+
+    `free_bytes` defaults to the live `mem_get_info` reading; the prefetch thread
+    passes the post-load baseline instead since a concurrent `generate` skews it.
+    Returns the user's `max_pixels` unchanged when nothing needs clamping (or the
+    resolution is unknown) so Qwen keeps its own defaults.
+    """
+    width, height = video_info.get('width'), video_info.get('height')
+    if not width or not height:
+        return max_pixels
+
+    native = width * height
+    pixels = int(native * scale ** 2)
+    if free_bytes is None and torch.cuda.is_available():
+        free_bytes, _ = torch.cuda.mem_get_info()
+    if free_bytes is not None:
+        pixels = min(pixels, pick_max_pixels(width, height, free_bytes // share))
+    if max_pixels:
+        pixels = min(pixels, max_pixels)
+
+    if pixels >= native:
+        return max_pixels
+    # Round down to a bucket so torch.compile sees a handful of shapes, not one per clip
+    return max(pixels // PIXEL_BUCKET * PIXEL_BUCKET, MIN_FRAME_PIXELS)
+
+
+def context_scale(video_info: Dict, fps: float | None, max_pixels: int | None) -> float:
+    """Largest scale whose video tokens fit MAX_VIDEO_TOKENS (1.0 if it fits or is unknown).
+
+    Qwen2-VL spends one token per 28×28 patch per pair of sampled frames. Raw videos
+    are first capped by qwen_vl_utils itself (per-frame and whole-clip pixel limits),
+    so only what survives that cap counts against the budget.
+    """
+    width, height = video_info.get('width'), video_info.get('height')
+    if not width or not height:
+        return 1.0
+    if video_info.get('duration'):
+        sampled = video_info['duration'] * (fps or 1.0)  # raw videos are sampled at 1 fps
+    elif video_info.get('frame_count'):
+        sampled = video_info['frame_count']
+    else:
+        return 1.0
+
+    native = width * height
+    pixels = min(native, max_pixels or native)
+    if fps is None:
+        # Same per-frame cap fetch_video derives for a raw video
+        pixels = min(pixels, max(
+            min(VIDEO_MAX_PIXELS, VIDEO_TOTAL_PIXELS / max(sampled, 1) * FRAME_FACTOR),
+            int(VIDEO_MIN_PIXELS * 1.05),
+        ))
+    temporal = math.ceil(sampled / 2)
+    if temporal * pixels / (28 * 28) <= MAX_VIDEO_TOKENS:
+        return 1.0
+    return max(MIN_SCALE, math.sqrt(MAX_VIDEO_TOKENS * 28 * 28 / (temporal * native)))
+
+
+def starting_scale(
+        oom_predictor: OOMPredictor, video_info: Dict, fps: float | None, max_pixels: int | None
+) -> Tuple[bool, float, str]:
+    """OOM prediction tightened by the context budget: (is_risky, scale, reason)."""
+    is_risky, scale, reason = oom_predictor.predict_oom_risk(video_info)
+    fit = context_scale(video_info, fps, max_pixels)
+    if fit < scale:
+        return True, fit, "token budget"
+    return is_risky, scale, reason
+
+
+@dataclass
+class PreparedVideo:
+    """CPU-side work for one video, produced ahead of time on the prefetch thread."""
+    vid: Path
+    info: Dict
+    bad: bool = False
+    risky: bool = False
+    vision: Optional[Tuple[List[Dict], Optional[list], Optional[list]]] = None
+    scale: float = 1.0  # scale `vision` was decoded at (risky videos start scaled down)
+    features: Optional[Dict[str, torch.Tensor]] = None  # pinned vision-processor output
+
+
+def frame_thumbs(frames) -> torch.Tensor:
+    """(N, 16·16·3) float thumbnails of a (T, C, H, W) tensor or a list of PIL frames."""
+    if isinstance(frames, torch.Tensor):
+        return F.adaptive_avg_pool2d(frames.float(), 16).reshape(frames.shape[0], -1)
+    return torch.stack([
+        torch.frombuffer(bytearray(im.convert("RGB").resize((16, 16), Image.BOX).tobytes()), dtype=torch.uint8)
+        for im in frames
+    ]).float()
+
+
+def merge_static_frames(video, min_sim: float):
+    """Drop frame pairs that are near-copies of the last kept pair.
+
+    Qwen2-VL turns each temporal pair of frames into one set of visual tokens, so a
+    static stretch costs the same prefill as a busy one. Pairs are compared on
+    mean-centred 16×16 thumbnails (cosine similarity); every dropped pair removes
+    its tokens before the vision tower and the LLM ever see them. `video` is a
+    frame tensor (raw videos, NVDEC) or a list of PIL frames (--fps sampling).
+    """
+    pairs = len(video) // 2
+    if min_sim <= 0 or pairs < 2:
+        return video
+    thumbs = frame_thumbs(video[:pairs * 2]).reshape(pairs, -1)
+    thumbs = F.normalize(thumbs - thumbs.mean(dim=1, keepdim=True), dim=1)
+    keep = [0]
+    for i in range(1, pairs):
+        if float(thumbs[i] @ thumbs[keep[-1]]) < min_sim:
+            keep.append(i)
+    if len(keep) == pairs:
+        return video
+    order = [2 * i + j for i in keep for j in (0, 1)]
+    if isinstance(video, torch.Tensor):
+        return video[torch.tensor(order)]
+    return [video[i] for i in order]
+
+
+def prepare_vision(
+        video: Path, fps: float | None, max_pixels: int | None, tmp_dir: Path, scale: float = 1.0,
+        merge_sim: float = 0.0,
+):
+    """Build the chat message and decode its frames: (messages, img_in, vid_in)."""
+    frames_dir = None
+    if fps is not None and av is None:
+        # Extracted JPEGs only live until process_vision_info has loaded them
+        frames_dir = Path(tempfile.mkdtemp(prefix=f"{video.stem}_", dir=tmp_dir))
+    try:
+        messages = [build_message(video, fps, max_pixels, frames_dir, scale)]
+        img_in, vid_in = process_vision_info(messages)
+    finally:
+        if frames_dir is not None:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+    if merge_sim > 0 and vid_in:
+        vid_in = [merge_static_frames(v, merge_sim) for v in vid_in]
+    return messages, img_in, vid_in
+
+
+def downscaled_vision(
+        video: Path, scale: float, fps: float | None, tmp_dir: Path, merge_sim: float = 0.0
+):
+    """Vision inputs at `scale` when the resolution is unknown (max_pixels can't clamp).
+
+    NVDEC + GPU resize when decord is available; otherwise frames are scaled while
+    decoding (PyAV, or one ffmpeg fps+scale pass). Only a raw video without PyAV
+    still needs the ffmpeg re-encode.
+    """
+    if decord is not None and torch.cuda.is_available():
+        try:
+            # The message only feeds the chat template; frames go to the processor as-is
+            frames = merge_static_frames(gpu_downscale(video, scale, fps), merge_sim)
+            return [build_message(video, None, None)], None, [frames]
+        except Exception as e:  # codec without NVDEC support, etc.
+            print(f"⚠️  NVDEC downscale failed for {video.name} ({e}) - using ffmpeg")
+
+    if av is not None or fps is not None:
+        # Raw videos are sampled at 1 fps by build_message anyway
+        return prepare_vision(video, fps or 1.0, None, tmp_dir, scale, merge_sim)
+
+    scaled_video = create_downscaled_video(video, scale, tmp_dir)
+    try:
+        return prepare_vision(scaled_video, fps, None, tmp_dir, merge_sim=merge_sim)
+    finally:
+        scaled_video.unlink(missing_ok=True)
+
+
+def prepare_video(
+        vid: Path,
+        fps: float | None,
+        max_pixels: int | None,
+        oom_predictor: OOMPredictor,
+        share: int,
+        free_bytes: int | None,
+        tmp_dir: Path,
+        processor: Optional[AutoProcessor] = None,
+        merge_sim: float = 0.0,
+) -> PreparedVideo:
+    """Probe, risk-check and decode one video (runs on the prefetch thread).
+
+    With `processor`, the decoded frames are also run through the vision processor
+    into pinned memory, so the GPU loop only has to issue the async copy.
+    """
+    entry = PreparedVideo(vid, get_video_info(vid))
+
+    frames = entry.info.get('frame_count')
+    if frames is None or frames < 2:
+        entry.bad = True
+        return entry
+
+    entry.risky, suggested_scale, _ = starting_scale(oom_predictor, entry.info, fps, max_pixels)
+
+    try:
+        if entry.risky:
+            # Decode at the scale the scaling path will start from, so it's ready when needed
+            entry.scale = suggested_scale
+            if entry.info.get('width') and entry.info.get('height'):
+                frame_pixels = frame_pixel_budget(
+                    entry.info, max_pixels, suggested_scale, share=share, free_bytes=free_bytes
+                )
+                entry.vision = prepare_vision(vid, fps, frame_pixels, tmp_dir, merge_sim=merge_sim)
+            else:
+                entry.vision = downscaled_vision(vid, suggested_scale, fps, tmp_dir, merge_sim)
+        else:
+            frame_pixels = frame_pixel_budget(entry.info, max_pixels, share=share, free_bytes=free_bytes)
+            entry.vision = prepare_vision(vid, fps, frame_pixels, tmp_dir, merge_sim=merge_sim)
+
+        _, img_in, vid_in = entry.vision
+        if processor is not None and img_in is None and vid_in and len(vid_in) == 1:
+            entry.features = video_features(processor, vid_in)
+    except Exception as e:
+        print(f"\n❌  Error preparing {vid.name}: {e}")
+        entry.bad = True
+    return entry
+
+
+def oom_recovery_cleanup():
+    """Aggressive GPU memory cleanup - only after a CUDA OOM.
+
+    `empty_cache` walks every cached block and forces re-allocation later, so it
+    must stay off the success path.
+    """
+    gc.collect()
     if torch.cuda.is_available():
-        torch.cuda.empty_cache()
+        # Sync first so the allocator sees every block freed by pending kernels
         torch.cuda.synchronize()
-        torch.cuda.ipc_collect()
-        # Force garbage collection multiple times
-        for _ in range(3):
-            gc.collect()
         torch.cuda.empty_cache()
+        torch.cuda.ipc_collect()
 
 
-def load_model(device: str) -> Tuple[Qwen2VLForConditionalGeneration, AutoProcessor]:
-    """Load the model and processor."""
-    print("🔮  Loading Qwen-VL-2B-Instruct…")
+def pick_dtype(device: str) -> torch.dtype:
+    """BF16 on Ampere+, FP16 on older GPUs, FP32 on CPU."""
+    if device.startswith("cuda") and torch.cuda.is_available():
+        major, _ = torch.cuda.get_device_capability()
+        return torch.bfloat16 if major >= 8 else torch.float16
+    return torch.float32
+
+
+def pick_attn_implementation(dtype: torch.dtype) -> str:
+    """FlashAttention-2 when installed on Ampere+, SDPA otherwise.
+
+    `pick_dtype` only returns BF16 on compute capability >= 8 - exactly where the
+    flash_attn kernels exist; FP16 means an older card that would fail at load.
+    """
+    if dtype == torch.bfloat16 and importlib.util.find_spec("flash_attn"):
+        return "flash_attention_2"
+    return "sdpa"
+
 
-    # Clear any existing GPU memory first
-    aggressive_cleanup()
+# Passing a skip list replaces transformers' default (which keeps the output head in
+# full precision), so lm_head - tied to the embeddings in Qwen2-VL-2B - is listed too
+QUANT_SKIP_MODULES = ["visual", "lm_head"]
 
+
+def quantization_config(quant: str, device: str, dtype: torch.dtype) -> Optional[BitsAndBytesConfig]:
+    """bitsandbytes config for the language model; the vision tower stays unquantized.
+
+    Falls back to unquantized weights (with a warning) without CUDA or a working
+    bitsandbytes install, so the `nf4` default never blocks a plain install.
+    """
+    if quant in ("none", "fp8"):
+        return None
+    try:
+        import bitsandbytes  # noqa: F401  # imported, not just found: a broken CUDA build fails here
+    except Exception:
+        bitsandbytes = None
+    if not device.startswith("cuda") or bitsandbytes is None:
+        print(f"⚠️  {quant} quantization needs CUDA + bitsandbytes - loading unquantized")
+        return None
+    if quant == "int8":
+        # LLM.int8: half the 2-byte weight traffic, closer to full-precision captions than NF4
+        return BitsAndBytesConfig(load_in_8bit=True, llm_int8_skip_modules=QUANT_SKIP_MODULES)
+    return BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=dtype,
+        bnb_4bit_use_double_quant=True,
+        llm_int8_skip_modules=QUANT_SKIP_MODULES,
+    )
+
+
+def quantize_fp8(model: Qwen2VLForConditionalGeneration, device: str) -> None:
+    """FP8 weight-only quantization of the language model via torchao (Ada/Hopper+).
+
+    Unlike bitsandbytes this keeps a compile-friendly fused matmul, so it pairs
+    well with --compile. The vision tower runs once per video and stays in 2 bytes.
+    """
+    if not device.startswith("cuda") or not importlib.util.find_spec("torchao"):
+        print("⚠️  fp8 quantization needs CUDA + torchao - running unquantized")
+        return
+    if torch.cuda.get_device_capability(torch.device(device)) < (8, 9):
+        print("⚠️  fp8 needs an Ada/Hopper GPU (sm_89+) - running unquantized")
+        return
+    from torchao.quantization import quantize_
+    try:
+        from torchao.quantization import Float8WeightOnlyConfig
+        config = Float8WeightOnlyConfig()
+    except ImportError:  # torchao < 0.10
+        from torchao.quantization import float8_weight_only
+        config = float8_weight_only()
+    quantize_(
+        model,
+        config,
+        filter_fn=lambda mod, fqn: (
+            isinstance(mod, torch.nn.Linear) and not fqn.startswith(tuple(QUANT_SKIP_MODULES))
+        ),
+    )
+
+
+def skip_decoder_blocks(model: Qwen2VLForConditionalGeneration, frac: float) -> None:
+    """Drop the middle `frac` of the language model's decoder blocks.
+
+    The first and last blocks carry most of the input/output mapping, so the cut
+    comes out of the middle. Layer indices are renumbered so the KV cache stays dense.
+    """
+    lm = getattr(model.model, "language_model", model.model)
+    layers = lm.layers
+    n = len(layers)
+    drop = min(n - 2, round(n * frac))
+    if drop <= 0:
+        return
+    head = (n - drop) // 2
+    keep = list(range(head)) + list(range(head + drop, n))
+    lm.layers = torch.nn.ModuleList(layers[i] for i in keep)
+    for new_idx, layer in enumerate(lm.layers):
+        layer.self_attn.layer_idx = new_idx
+
+    for cfg in (model.config, getattr(model.config, "text_config", None)):
+        if cfg is None:
+            continue
+        cfg.num_hidden_layers = len(keep)
+        if getattr(cfg, "layer_types", None):
+            cfg.layer_types = [cfg.layer_types[i] for i in keep]
+    print(f"✂️  Skipping {drop}/{n} decoder blocks ({head}..{head + drop - 1})")
+
+
+def load_model(
+        device: str, quant: str = "nf4", compile_model: bool = False, skip_blocks: float = 0.0,
+        max_pixels: int | None = None,
+) -> Tuple[Qwen2VLForConditionalGeneration, AutoProcessor]:
+    """Load the model and processor.
+
+    VRAM fragmentation is handled by the `PYTORCH_CUDA_ALLOC_CONF` default set at
+    import time (expandable segments); export your own value to override it.
+    """
+    print("🔮  Loading Qwen-VL-2B-Instruct…")
+
+    # "auto" can resolve to FP32 weights on some revisions - pin 2-byte precision
+    dtype = pick_dtype(device)
+    # Any matmul/conv left in FP32 still runs on tensor cores
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
     model = Qwen2VLForConditionalGeneration.from_pretrained(
         "Qwen/Qwen2-VL-2B-Instruct",
-        torch_dtype="auto",
-        device_map="auto"
+        torch_dtype=dtype,
+        attn_implementation=pick_attn_implementation(dtype),
+        quantization_config=quantization_config(quant, device, dtype),
+        # Whole model on one GPU - "auto" would shard it layer-wise across every
+        # visible card, which only serializes them; use --num-gpus for more GPUs
+        device_map={"": torch.device(device).index or 0} if device.startswith("cuda") else "auto"
     ).eval()
-
-    processor = AutoProcessor.from_pretrained("Qwen/Qwen2-VL-2B-Instruct")
+    if quant == "fp8":
+        quantize_fp8(model, device)
+    # Before compile: the static cache and CUDA graphs are sized by the layer count
+    skip_decoder_blocks(model, skip_blocks)
+
+    # Fast (torchvision) image processor: resize/normalize in compiled ops, not PIL + numpy
+    processor = AutoProcessor.from_pretrained("Qwen/Qwen2-VL-2B-Instruct", use_fast=True)
+    # Decoder-only batched generation needs prompts padded on the left
+    processor.tokenizer.padding_side = "left"
+
+    if compile_model and device != "cpu":
+        # A static KV cache is allocated once (and reused while the batch size and
+        # prompt length fit), so the decode step has fixed shapes CUDA graphs can replay
+        model.generation_config.cache_implementation = "static"
+        # CUDA graphs strip per-step launch overhead from the MAX_NEW_TOKENS decode loop
+        torch._dynamo.config.cache_size_limit = 16
+        model.forward = torch.compile(model.forward, mode="reduce-overhead", dynamic=False)
+        warm_up(model, processor, device, max_pixels)
 
     return model, processor
 
 
-def safe_processor_call(processor, prompt: str, img_in, vid_in, device: str):
-    """Safely call processor with fallback for kwargs issues."""
+def warm_up(
+        model: Qwen2VLForConditionalGeneration, processor: AutoProcessor, device: str,
+        max_pixels: int | None = None,
+) -> None:
+    """One full-size generate so compilation + graph capture happen at load, not mid-run.
+
+    A blank clip at the largest per-frame size (`max_pixels`, else qwen_vl_utils'
+    VIDEO_MAX_PIXELS) with as many frame pairs as MAX_VIDEO_TOKENS allows, decoded
+    for MAX_NEW_TOKENS through the same `generate_with_timeout` call as real
+    batches: the static KV cache is allocated at its largest and the prefill and
+    decode graphs are captured before the first video.
+    """
+    print("🔥  Warming up compiled model…")
+    start = time.monotonic()
+    pixels = min(max_pixels or VIDEO_MAX_PIXELS, VIDEO_MAX_PIXELS)
+    side = int(math.sqrt(pixels))
+    height, width = smart_resize(side, side, max_pixels=pixels)
+    pairs = max(1, MAX_VIDEO_TOKENS // (height * width // (28 * 28)))
+    # qwen_vl_utils hands videos over as float (T, C, H, W) tensors in 0-255
+    frames = torch.zeros((pairs * FRAME_FACTOR, 3, height, width))
+    messages = [build_message(Path("warm_up.mp4"), None, None)]
     try:
-        # Try the standard call first
-        inputs = processor(
-            text=[prompt],
-            images=img_in,
-            videos=vid_in,
-            padding=True,
-            return_tensors="pt",
+        inputs = move_inputs(
+            video_inputs(processor, messages, video_features(processor, [frames])), device, model.dtype
         )
-    except TypeError as e:
-        if "return_tensors" in str(e) or "unrecognized kwargs" in str(e):
-            # Fallback without return_tensors
-            try:
-                inputs = processor(
-                    text=[prompt],
-                    images=img_in,
-                    videos=vid_in,
-                    padding=True,
-                )
-                # Convert to tensors manually if needed
-                for key, value in inputs.items():
-                    if isinstance(value, list) and len(value) > 0:
-                        if isinstance(value[0], (int, float)):
-                            inputs[key] = torch.tensor(value)
-                        elif hasattr(value[0], '__iter__'):
-                            inputs[key] = torch.tensor(value)
-            except Exception:
-                # Last resort - try minimal call
-                inputs = processor(text=[prompt], padding=True)
-        else:
-            raise
+        generate_with_timeout(model, inputs, timeout=600.0)
+    except Exception as e:
+        print(f"⚠️  Warm-up failed ({e}) - compilation happens on the first batch instead")
+        return
+    finally:
+        # Activations of the warm-up prefill shouldn't count against the prefetch
+        # thread's free-VRAM baseline (the static cache stays allocated)
+        torch.cuda.empty_cache()
+    print(f"🔥  Warm-up done in {time.monotonic() - start:.1f}s")
+
+
+_PROMPT_CACHE: Dict[int, str] = {}
+
+
+def video_prompt(processor, messages: List[Dict]) -> str:
+    """Chat-templated prompt for `messages`, rendered once per processor.
+
+    The template renders the video as a `<|video_pad|>` placeholder, so the text is
+    identical for every clip - only the processor's vision inputs differ.
+    """
+    key = id(processor)
+    if key not in _PROMPT_CACHE:
+        _PROMPT_CACHE[key] = processor.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+    return _PROMPT_CACHE[key]
+
+
+VIDEO_PAD = "<|video_pad|>"
+_PROMPT_IDS: Dict[int, Tuple[List[int], List[int]]] = {}
+
+
+def prompt_ids(processor, messages: List[Dict]) -> Tuple[List[int], List[int]]:
+    """Token ids before/after the video placeholder, tokenized once per processor."""
+    key = id(processor)
+    if key not in _PROMPT_IDS:
+        prefix, _, suffix = video_prompt(processor, messages).partition(VIDEO_PAD)
+        tokenizer = processor.tokenizer
+        _PROMPT_IDS[key] = (
+            tokenizer.encode(prefix, add_special_tokens=False),
+            tokenizer.encode(suffix, add_special_tokens=False),
+        )
+    return _PROMPT_IDS[key]
+
+
+def video_features(processor, vid_in: list) -> Dict[str, torch.Tensor]:
+    """Vision-processor output for `vid_in`, pinned so its H2D copy can run async."""
+    if hasattr(processor, "video_processor"):
+        vision = processor.video_processor(videos=vid_in, return_tensors="pt")
+    else:
+        vision = processor.image_processor(images=None, videos=vid_in, return_tensors="pt")
+    pin = torch.cuda.is_available()
+    return {k: v.pin_memory() if pin and isinstance(v, torch.Tensor) else v for k, v in vision.items()}
+
+
+def merge_features(features: Sequence[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+    """Concatenate per-video features straight into pinned buffers."""
+    if len(features) == 1:
+        return features[0]
+    merged = {}
+    for key in features[0]:
+        parts = [f[key] for f in features]
+        out = torch.empty(
+            (sum(p.shape[0] for p in parts), *parts[0].shape[1:]),
+            dtype=parts[0].dtype, pin_memory=torch.cuda.is_available(),
+        )
+        merged[key] = torch.cat(parts, out=out)
+    return merged
+
+
+def video_inputs(processor, messages: List[Dict], vision: Dict[str, torch.Tensor]) -> BatchFeature:
+    """Processor output for one-video-per-prompt batches, without tokenizing text.
+
+    The stock processor expands each `<|video_pad|>` into one copy per visual token
+    (thousands per clip) and re-tokenizes that string; here only the vision
+    processor runs (`video_features`) and the ids are assembled around the cached
+    prefix/suffix.
+    """
+    prefix, suffix = prompt_ids(processor, messages)
+    tokenizer = processor.tokenizer
+    pad_id = tokenizer.convert_tokens_to_ids(VIDEO_PAD)
+    merge = processor.image_processor.merge_size ** 2
+    rows = [prefix + [pad_id] * (int(thw.prod()) // merge) + suffix for thw in vision["video_grid_thw"]]
+
+    # Left padding, as the tokenizer is configured for batched generation
+    width = max(len(row) for row in rows)
+    input_ids = torch.full((len(rows), width), tokenizer.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(rows), width), dtype=torch.long)
+    for i, row in enumerate(rows):
+        input_ids[i, width - len(row):] = torch.tensor(row)
+        attention_mask[i, width - len(row):] = 1
+    return BatchFeature(data={"input_ids": input_ids, "attention_mask": attention_mask, **vision})
+
+
+def safe_processor_call(
+        processor, prompts: List[str], img_in, vid_in, device: str, dtype: torch.dtype | None = None
+):
+    """Tokenize prompts + preprocess frames, then stage the tensors on `device`."""
+    inputs = processor(
+        text=prompts,
+        images=img_in,
+        videos=vid_in,
+        padding=True,
+        return_tensors="pt",
+    )
+    return move_inputs(inputs, device, dtype)
+
+
+_COPY_STREAM: Optional[torch.cuda.Stream] = None
+
+
+def move_inputs(inputs, device: str, dtype: torch.dtype | None = None):
+    """H2D copy of processor outputs from pinned memory on a side stream.
 
-    return inputs.to(device)
+    Float members are cast to `dtype` on the GPU after the copy; token ids stay
+    integral. The compute stream waits on the copy stream before returning.
+    """
+    if not device.startswith("cuda") or not torch.cuda.is_available():
+        return inputs.to(device, dtype=dtype) if dtype is not None else inputs.to(device)
+
+    global _COPY_STREAM
+    if _COPY_STREAM is None:
+        _COPY_STREAM = torch.cuda.Stream()
+
+    compute = torch.cuda.current_stream()
+    moved = {}
+    with torch.cuda.stream(_COPY_STREAM):
+        for key, value in inputs.items():
+            if not isinstance(value, torch.Tensor):
+                moved[key] = value
+                continue
+            if not value.is_pinned():
+                value = value.pin_memory()
+            value = value.to(device, non_blocking=True)
+            if dtype is not None and value.is_floating_point():
+                value = value.to(dtype)
+            # Tell the allocator the compute stream uses this block too
+            value.record_stream(compute)
+            moved[key] = value
+    compute.wait_stream(_COPY_STREAM)
+    return BatchFeature(data=moved)
 
 
 def process_single_video_with_prediction(
@@ -363,14 +1206,24 @@ def process_single_video_with_prediction(
         device: str,
         tmp_dir: Path,
         oom_predictor: OOMPredictor,
+        video_info: Optional[Dict] = None,
+        prepared: Optional[Tuple] = None,
+        prepared_scale: float = 1.0,
+        prepared_features: Optional[Dict[str, torch.Tensor]] = None,
+        merge_sim: float = 0.0,
 ) -> Optional[str]:
-    """Process a single video with OOM prediction and progressive scaling."""
+    """Process a single video with OOM prediction and progressive scaling.
+
+    `prepared` is prefetched (messages, img_in, vid_in) decoded at `prepared_scale`,
+    with its pinned `prepared_features`; it is used for the attempt at that scale.
+    """
 
     # Get video info for prediction
-    video_info = get_video_info(vid)
+    if video_info is None:
+        video_info = get_video_info(vid)
 
-    # Predict OOM risk
-    is_risky, suggested_scale, reason = oom_predictor.predict_oom_risk(video_info)
+    # Predict OOM risk; over-long clips are pre-scaled to fit the context
+    is_risky, suggested_scale, reason = starting_scale(oom_predictor, video_info, fps, max_pixels)
 
     if is_risky:
         print(f"🔍  {vid.name}: Predicted OOM risk ({reason}) - starting at {suggested_scale:.0%}")
@@ -378,111 +1231,255 @@ def process_single_video_with_prediction(
     else:
         current_scale = 1.0
 
-    current_video = vid
-    scaled_video_path = None
+    # With a known resolution Qwen resizes frames via max_pixels - no re-encode needed
+    can_clamp = bool(video_info.get('width') and video_info.get('height'))
+
+    # Scaling never changes the frame count - probe at most once
+    frames = video_info.get('frame_count') or get_num_frames(vid)
+    if frames is None or frames < 2:
+        return None
 
     while current_scale >= MIN_SCALE:
         try:
-            # Create scaled video if needed
-            if current_scale < 1.0 and current_video == vid:
-                scaled_video_path = create_downscaled_video(vid, current_scale, tmp_dir)
-                current_video = scaled_video_path
-
-            # Set up timeout
-            signal.signal(signal.SIGALRM, timeout_handler)
-            signal.alarm(TIMEOUT_SECONDS)
-
-            frames = get_num_frames(current_video)
-            if frames is None or frames < 2:
-                return None
-
-            messages = [build_message(current_video, fps, max_pixels)]
-            prompt = processor.apply_chat_template(
-                messages, tokenize=False, add_generation_prompt=True
-            )
-            img_in, vid_in = process_vision_info(messages)
-
-            # Use safe processor call
-            inputs = safe_processor_call(processor, prompt, img_in, vid_in, device)
-
-            with torch.inference_mode():
-                out_ids = model.generate(**inputs, max_new_tokens=128)
+            features = None
+            if prepared is not None and current_scale == prepared_scale:
+                vision, features = prepared, [prepared_features]
+                prepared = prepared_features = None
+            elif not can_clamp and current_scale < 1.0:
+                vision = downscaled_vision(vid, current_scale, fps, tmp_dir, merge_sim)
+            else:
+                frame_pixels = frame_pixel_budget(video_info, max_pixels, current_scale)
+                vision = prepare_vision(vid, fps, frame_pixels, tmp_dir, merge_sim=merge_sim)
 
-            trimmed = out_ids[:, inputs.input_ids.shape[1]:]
-            caption = processor.batch_decode(
-                trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+            # All CUDA tensors live inside generate_captions and die when it returns
+            caption = generate_captions(
+                [vision], model, processor, device, TIMEOUT_SECONDS, features
             )[0]
 
-            # Clean up tensors
-            del inputs, out_ids, trimmed
-            aggressive_cleanup()
-
-            # Clean up any scaled video file
-            if scaled_video_path and scaled_video_path.exists():
-                scaled_video_path.unlink()
-
-            scale_info = f" (scaled to {current_scale:.0%})" if current_scale < 1.0 else ""
             if current_scale < 1.0:
-                print(f"✅ Processed {vid.name}{scale_info}")
+                print(f"✅ Processed {vid.name} (scaled to {current_scale:.0%})")
 
-            return caption.strip()
+            return caption
 
         except TimeoutError:
-            print(f"\n⏰  Timeout processing {vid.name} - will reload model and continue")
+            print(f"\n⏰  Timeout processing {vid.name} - moving it aside")
             return "TIMEOUT"
 
         except RuntimeError as e:
-            if "CUDA out of memory" in str(e) or "out of memory" in str(e):
-                print(f"\n🔥  CUDA OOM for {vid.name} at {current_scale:.0%} scale")
-
-                # Record this OOM failure if at original scale
-                if current_scale == 1.0:
-                    oom_predictor.record_oom_failure(video_info)
-
-                # Aggressive cleanup after OOM
-                signal.alarm(0)  # Cancel timeout
-                if 'inputs' in locals():
-                    del inputs
-                if 'out_ids' in locals():
-                    del out_ids
-                if 'trimmed' in locals():
-                    del trimmed
-                aggressive_cleanup()
-                time.sleep(1)  # Brief pause
-
-                # Try scaling down
-                current_scale -= SCALE_STEP
-                if current_scale < MIN_SCALE:
-                    print(f"❌  Cannot scale {vid.name} below {MIN_SCALE:.0%}, giving up")
-                    return None
-
-                # Clean up previous scaled video
-                if scaled_video_path and scaled_video_path.exists():
-                    scaled_video_path.unlink()
-
-                print(f"🔽  Scaling down to {current_scale:.0%} and retrying...")
-
-                try:
-                    scaled_video_path = create_downscaled_video(vid, current_scale, tmp_dir)
-                    current_video = scaled_video_path
-                    # Continue the loop to retry with scaled video
-                    continue
-                except Exception as scale_error:
-                    print(f"❌  Failed to scale video: {scale_error}")
-                    return None
-            else:
+            if "out of memory" not in str(e):
                 print(f"\n❌  Error processing {vid.name}: {e}")
                 return None
 
         except Exception as e:
             print(f"\n❌  Error processing {vid.name}: {e}")
             return None
-        finally:
-            signal.alarm(0)  # Cancel the alarm
+
+        # Only an OOM gets here - past the except block, so its traceback
+        # (and the frames holding the failed attempt's tensors) is already gone
+        print(f"\n🔥  CUDA OOM for {vid.name} at {current_scale:.0%} scale")
+
+        # Record this OOM failure if at original scale
+        if current_scale == 1.0:
+            oom_predictor.record_oom_failure(video_info)
+
+        oom_recovery_cleanup()
+        time.sleep(1)  # Brief pause
+
+        # Try scaling down
+        current_scale -= SCALE_STEP
+        if current_scale < MIN_SCALE:
+            print(f"❌  Cannot scale {vid.name} below {MIN_SCALE:.0%}, giving up")
+            return None
+
+        print(f"🔽  Scaling down to {current_scale:.0%} and retrying...")
 
     return None
 
 
+def _concat_inputs(parts: Sequence[Optional[list]]) -> Optional[list]:
+    merged = [x for part in parts if part for x in part]
+    return merged or None
+
+
+def generate_captions(
+        visions: Sequence[Tuple],
+        model: Qwen2VLForConditionalGeneration,
+        processor: AutoProcessor,
+        device: str,
+        timeout: float,
+        features: Optional[Sequence[Optional[Dict[str, torch.Tensor]]]] = None,
+) -> List[str]:
+    """Caption several videos' (messages, img_in, vid_in) with one padded `generate` call.
+
+    `features` are prefetched `video_features` per video, used when all are present.
+    Inputs and outputs are locals here, so they are released on return - callers
+    never hold CUDA tensors across a retry.
+    """
+    img_in = _concat_inputs([v[1] for v in visions])
+    vid_in = _concat_inputs([v[2] for v in visions])
+
+    if features and all(f is not None for f in features):
+        inputs = move_inputs(
+            video_inputs(processor, visions[0][0], merge_features(features)), device, model.dtype
+        )
+    elif img_in is None and vid_in is not None and len(vid_in) == len(visions):
+        # One video per prompt (every path here): skip text tokenization entirely
+        inputs = move_inputs(
+            video_inputs(processor, visions[0][0], video_features(processor, vid_in)), device, model.dtype
+        )
+    else:
+        prompts = [video_prompt(processor, messages) for messages, _, _ in visions]
+        inputs = safe_processor_call(processor, prompts, img_in, vid_in, device, model.dtype)
+    # Prompts are left-padded, so every row's new tokens start at the same offset
+    prompt_len = inputs.input_ids.shape[1]
+
+    out_ids = generate_with_timeout(model, inputs, timeout)
+    # pixel_values dwarf everything else here - release them before the trim/copy,
+    # not at function exit
+    del inputs
+
+    # Only the new tokens leave the GPU; the full prompt+output tensor is dropped
+    trimmed = out_ids[:, prompt_len:].cpu()
+    del out_ids
+    captions = processor.batch_decode(
+        trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+    )
+    return [c.strip() for c in captions]
+
+
+def process_batch_with_fallback(
+        batch: List[PreparedVideo],
+        model: Qwen2VLForConditionalGeneration,
+        processor: AutoProcessor,
+        fps: float | None,
+        max_pixels: int | None,
+        device: str,
+        tmp_dir: Path,
+        oom_predictor: OOMPredictor,
+        merge_sim: float = 0.0,
+) -> Dict[Path, Optional[str]]:
+    """Caption a batch; on OOM halve it, only scaling videos once the batch is 1."""
+    if len(batch) == 1:
+        e = batch[0]
+        return {e.vid: process_single_video_with_prediction(
+            e.vid, model, processor, fps, max_pixels, device, tmp_dir, oom_predictor,
+            e.info, e.vision, e.scale, e.features, merge_sim,
+        )}
+
+    oom = False
+    try:
+        captions = generate_captions(
+            [e.vision for e in batch], model, processor, device, TIMEOUT_SECONDS * len(batch),
+            [e.features for e in batch],
+        )
+        return {e.vid: c for e, c in zip(batch, captions)}
+
+    except TimeoutError:
+        # Retry one by one so only the slow clip ends up in timeout_failures
+        print(f"\n⏰  Batch of {len(batch)} timed out - retrying videos individually")
+
+    except RuntimeError as e:
+        if "out of memory" in str(e):
+            oom = True
+        else:
+            print(f"\n❌  Error processing batch of {len(batch)}: {e} - retrying individually")
+
+    except Exception as e:
+        print(f"\n❌  Error processing batch of {len(batch)}: {e} - retrying individually")
+
+    if oom:
+        # Cleanup outside the except block so the traceback no longer pins tensors
+        oom_recovery_cleanup()
+        half = len(batch) // 2
+        print(f"\n🔥  CUDA OOM for batch of {len(batch)} - halving to {half}")
+        chunks = [batch[:half], batch[half:]]
+    else:
+        chunks = [[item] for item in batch]
+
+    results: Dict[Path, Optional[str]] = {}
+    for chunk in chunks:
+        results.update(process_batch_with_fallback(
+            chunk, model, processor, fps, max_pixels, device, tmp_dir, oom_predictor, merge_sim
+        ))
+    return results
+
+
+def bucket_key(info: Dict) -> Tuple:
+    """(width, height, frame count rounded up) - videos sharing it pad to near-equal lengths."""
+    frames = info.get('frame_count') or 0
+    return info.get('width'), info.get('height'), -(-frames // FRAME_BUCKET) * FRAME_BUCKET
+
+
+def visual_tokens(entry: PreparedVideo) -> int | None:
+    """Visual tokens the LLM will see for a prefetched video (2×2 patch merge)."""
+    if entry.features is None:
+        return None
+    return int(entry.features["video_grid_thw"].prod(dim=-1).sum()) // 4
+
+
+def pack_by_tokens(batch: List[PreparedVideo], budget: int) -> List[List[PreparedVideo]]:
+    """Split `batch` so each chunk's padded size (rows × longest) fits `budget`.
+
+    Sorted longest-first, neighbours have similar lengths, so little of each chunk
+    is padding. Videos without a known token count keep their own chunk.
+    """
+    known = sorted((e for e in batch if visual_tokens(e) is not None), key=visual_tokens, reverse=True)
+    chunks: List[List[PreparedVideo]] = []
+    for e in known:
+        # The first (longest) row of a chunk sets its padded width
+        if chunks and visual_tokens(chunks[-1][0]) * (len(chunks[-1]) + 1) <= budget:
+            chunks[-1].append(e)
+        else:
+            chunks.append([e])
+    unknown = [e for e in batch if visual_tokens(e) is None]
+    if unknown:
+        chunks.append(unknown)
+    return chunks
+
+
+def process_video_batch(
+        entries: Sequence[PreparedVideo],
+        model: Qwen2VLForConditionalGeneration,
+        processor: AutoProcessor,
+        fps: float | None,
+        max_pixels: int | None,
+        device: str,
+        tmp_dir: Path,
+        oom_predictor: OOMPredictor,
+        merge_sim: float = 0.0,
+) -> List[Tuple[Path, Optional[str]]]:
+    """Caption prepared videos, batching the safe ones; results keep the input order."""
+    results: Dict[Path, Optional[str]] = {}
+    buckets: Dict[Tuple, List[PreparedVideo]] = {}
+
+    for e in entries:
+        if e.bad:
+            results[e.vid] = None
+        elif e.risky:
+            # Predicted OOM risk goes straight to the scaling path
+            results[e.vid] = process_single_video_with_prediction(
+                e.vid, model, processor, fps, max_pixels, device, tmp_dir, oom_predictor,
+                e.info, e.vision, e.scale, e.features, merge_sim,
+            )
+        else:
+            buckets.setdefault(bucket_key(e.info), []).append(e)
+
+    # One generate per shape bucket: mixed lengths would pad every row to the longest.
+    # Lone videos still share a (padded) call rather than running one by one.
+    groups = [b for b in buckets.values() if len(b) > 1]
+    mixed = [b[0] for b in buckets.values() if len(b) == 1]
+    if mixed:
+        groups.append(mixed)
+    # ...and no call pads past the token budget
+    groups = [chunk for group in groups for chunk in pack_by_tokens(group, BATCH_TOKEN_BUDGET)]
+    for batch in groups:
+        results.update(process_batch_with_fallback(
+            batch, model, processor, fps, max_pixels, device, tmp_dir, oom_predictor, merge_sim
+        ))
+
+    return [(e.vid, results[e.vid]) for e in entries]
+
+
 # ─── Captioner core ─────────────────────────────────────────────────────────
 def caption(
         videos: Sequence[Path],
@@ -492,106 +1489,142 @@ def caption(
         max_pixels: int | None,
         device: str,
         skip_dir: Path,
+        batch_size: int = 4,
+        quant: str = "nf4",
+        compile_model: bool = False,
+        skip_blocks: float = 0.0,
+        merge_sim: float = 0.0,
 ):
     # Initialize OOM predictor
     oom_predictor = OOMPredictor(skip_dir / OOM_HISTORY_FILE)
 
+    # Probes from earlier runs; written back on exit, however the run ends
+    probe_cache = skip_dir / PROBE_CACHE_FILE
+    load_probe_cache(probe_cache)
+    atexit.register(save_probe_cache, probe_cache)
+
     # --- gather already captioned -------------------------------------------
     done: set[str] = set()
     if fmt == "txt":
-        for vid in videos:
-            if (out_path / vid.with_suffix(".txt").name).exists():
-                done.add(str(vid))
+        # One directory listing instead of a stat() per video
+        done_stems = set()
+        if out_path.is_dir():
+            with os.scandir(out_path) as it:
+                done_stems = {e.name[:-4] for e in it if e.name.endswith(".txt")}
+        done = {str(vid) for vid in videos if vid.stem in done_stems}
     else:  # jsonl
         if out_path.exists():
-            with out_path.open() as f:
-                for line in f:
-                    try:
-                        done.add(json.loads(line)["path"])
-                    except Exception:
-                        pass
+            done = captioned_paths(out_path)
+
+    todo = [vid for vid in videos if str(vid) not in done]  # leave captioned ones be 🌱
+    if not todo:
+        # Resume with nothing left: don't pay for a model load (or any probing)
+        print(f"\n\033[32m✅  All {len(videos)} video(s) already captioned → {out_path}\033[0m")
+        return
 
     bad_dir = skip_dir / "bad_frames"
     timeout_dir = skip_dir / "timeout_failures"
     bad_dir.mkdir(parents=True, exist_ok=True)
     timeout_dir.mkdir(parents=True, exist_ok=True)
 
-    # Create temp directory for scaled videos
-    temp_dir = Path(tempfile.mkdtemp(prefix="scaled_videos_"))
+    # Same mount: parking a clip is one rename, done on the spot. Across mounts each
+    # move is a full copy + delete, so those are queued and swept in parallel at the end
+    same_fs = os.stat(skip_dir).st_dev == os.stat(todo[0].parent).st_dev
+    deferred_moves: List[Tuple[Path, Path]] = []
+
+    def park(vid: Path, dst_dir: Path) -> None:
+        if same_fs:
+            fast_move(vid, dst_dir / vid.name)
+        else:
+            deferred_moves.append((vid, dst_dir / vid.name))
+
+    # One temp root for the whole run: scaled videos + per-video frame folders
+    temp_ctx = tempfile.TemporaryDirectory(prefix="magix_frames_")
+    temp_dir = Path(temp_ctx.name)
 
     # --- load model ----------------------------------------------------------
-    model, processor = load_model(device)
+    model, processor = load_model(device, quant, compile_model, skip_blocks, max_pixels)
+    # VRAM left after the weights; the prefetch thread budgets frames against it
+    free_bytes = torch.cuda.mem_get_info()[0] if torch.cuda.is_available() else None
 
     # --- prepare output ------------------------------------------------------
     if fmt == "txt":
         out_path.mkdir(parents=True, exist_ok=True)
     else:
         out_path.parent.mkdir(parents=True, exist_ok=True)
-        out_jsonl = out_path.open("a", encoding="utf-8")
+        out_jsonl = open(out_path, "ab", buffering=1 << 20)
 
     # --- main loop -----------------------------------------------------------
     processed_count = 0
     timeout_count = 0
 
-    try:
-        for i, vid in enumerate(tqdm(videos, desc="Captioning")):
-            if str(vid) in done:
-                continue  # already captioned, leave it be 🌱
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    pbar = tqdm(total=len(videos), initial=len(videos) - len(todo), desc="Captioning")
 
-            caption_result = process_single_video_with_prediction(
-                vid, model, processor, fps, max_pixels, device, temp_dir, oom_predictor
-            )
-
-            if caption_result == "TIMEOUT":
-                # Handle timeout - reload model and move video
-                timeout_count += 1
-                shutil.move(str(vid), timeout_dir / vid.name)
+    # ffprobe + frame decoding for the next PREFETCH_DEPTH batches runs while batch i
+    # is on the GPU; timeouts are a StoppingCriteria, so nothing here needs the main thread.
+    # One worker per queued video, capped by the cores ffprobe/ffmpeg can use.
+    pool = ThreadPoolExecutor(max_workers=max(1, min(os.cpu_count() or 1, PREFETCH_DEPTH * batch_size)))
 
-                # Reload model every few timeouts
-                if timeout_count % 3 == 0:
-                    print(f"\n🔄  Reloading model after {timeout_count} timeouts...")
-                    del model, processor
-                    aggressive_cleanup()
-                    time.sleep(2)  # Brief pause
-                    model, processor = load_model(device)
-                    processed_count = 0
+    def submit(batch: List[Path]):
+        return [
+            pool.submit(
+                prepare_video, vid, fps, max_pixels, oom_predictor, len(batch), free_bytes, temp_dir,
+                processor, merge_sim,
+            )
+            for vid in batch
+        ]
 
-                continue
+    pending = deque(submit(batch) for batch in batches[:PREFETCH_DEPTH])
 
-            elif caption_result is None:
-                # Regular failure - move to bad_frames
-                shutil.move(str(vid), bad_dir / vid.name)
-                continue
+    try:
+        for i in range(len(batches)):
+            entries = [fut.result() for fut in pending.popleft()]
+            if i + PREFETCH_DEPTH < len(batches):
+                pending.append(submit(batches[i + PREFETCH_DEPTH]))
+            batch_results = process_video_batch(
+                entries, model, processor, fps, max_pixels, device, temp_dir, oom_predictor, merge_sim
+            )
+            pbar.update(len(batch_results))
+            for vid, caption_result in batch_results:
+                if caption_result == "TIMEOUT":
+                    # The watchdog stops generate between decode steps, so the model is
+                    # still healthy - just park the clip
+                    timeout_count += 1
+                    park(vid, timeout_dir)
+                    continue
 
-            # Success - save caption
-            if fmt == "txt":
-                (out_path / vid.with_suffix(".txt").name).write_text(
-                    caption_result + "\n", encoding="utf-8"
-                )
-            else:
-                out_jsonl.write(json.dumps({"path": str(vid), "caption": caption_result}) + "\n")
+                elif caption_result is None:
+                    # Regular failure - move to bad_frames
+                    park(vid, bad_dir)
+                    continue
 
-            processed_count += 1
+                # Success - save caption
+                if fmt == "txt":
+                    (out_path / vid.with_suffix(".txt").name).write_text(
+                        caption_result + "\n", encoding="utf-8"
+                    )
+                else:
+                    out_jsonl.write(jsonl_line({"path": str(vid), "caption": caption_result}))
 
-            # Periodic cleanup
-            if processed_count % 50 == 0:
-                print(f"\n🧹  Periodic cleanup after {processed_count} videos...")
-                aggressive_cleanup()
+                processed_count += 1
 
-            # Reload model periodically for very long runs
-            if processed_count % 300 == 0:
-                print(f"\n🔄  Periodic model reload after {processed_count} videos...")
-                del model, processor
-                aggressive_cleanup()
-                time.sleep(2)
-                model, processor = load_model(device)
+                # Bound what a crash can lose from the 1 MiB write buffer
+                if fmt == "jsonl" and processed_count % FLUSH_EVERY == 0:
+                    out_jsonl.flush()
 
     finally:
-        # Cleanup temp directory
-        shutil.rmtree(temp_dir, ignore_errors=True)
-
-    if fmt == "jsonl":
-        out_jsonl.close()
+        # Drop queued prefetches but let a running one finish: it may be writing
+        # frames into temp_ctx, which is deleted next
+        pool.shutdown(wait=True, cancel_futures=True)
+        pbar.close()
+        temp_ctx.cleanup()
+        if fmt == "jsonl":
+            out_jsonl.close()
+        if deferred_moves:
+            print(f"📦  Moving {len(deferred_moves)} failed video(s) to {skip_dir}…")
+            with ThreadPoolExecutor(max_workers=min(8, len(deferred_moves))) as movers:
+                list(movers.map(lambda m: shutil.move(str(m[0]), m[1]), deferred_moves))
 
     print(f"\n\033[32m✅  Captions stored at → {out_path}\033[0m")
     print(f"⚠️   Uncaptionable videos moved to → {bad_dir}")
@@ -599,6 +1632,57 @@ def caption(
         print(f"⏰  {timeout_count} videos timed out and moved to → {timeout_dir}")
 
 
+# ─── Multi-GPU ──────────────────────────────────────────────────────────────
+def shard_path(out_path: Path, rank: int) -> Path:
+    """Per-GPU JSONL file next to `out_path` (merged back after the run)."""
+    return out_path.with_suffix(f".rank{rank}.jsonl")
+
+
+def merge_shards(out_path: Path, world: int) -> None:
+    """Append every per-GPU JSONL into `out_path` and remove it (also after a crash)."""
+    shards = [shard_path(out_path, rank) for rank in range(world)]
+    shards = [shard for shard in shards if shard.exists()]
+    if not shards:
+        return
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "ab") as dst:
+        for shard in shards:
+            with open(shard, "rb") as src:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            shard.unlink()
+
+
+def caption_worker(rank: int, gpu_ids: List[str], videos: List[Path], kwargs: Dict) -> None:
+    """One GPU's share of the videos - a spawned process that sees only its own card."""
+    # Before anything touches CUDA in this process
+    os.environ["CUDA_VISIBLE_DEVICES"] = gpu_ids[rank]
+    kwargs = dict(kwargs)
+    if kwargs["fmt"] == "jsonl":
+        kwargs["out_path"] = shard_path(kwargs["out_path"], rank)
+    caption(videos=videos[rank::len(gpu_ids)], **kwargs)
+
+
+def caption_multi_gpu(videos: List[Path], num_gpus: int, **kwargs) -> None:
+    """Data-parallel captioning: one full model per GPU, each on a strided shard."""
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    gpu_ids = visible.split(",") if visible else [str(i) for i in range(torch.cuda.device_count())]
+    gpu_ids = gpu_ids[:num_gpus]
+    print(f"🖥️  Captioning on {len(gpu_ids)} GPU(s): {', '.join(gpu_ids)}")
+
+    if kwargs["fmt"] == "jsonl":
+        # Fold in shards a crashed run left behind, then hand out only unfinished videos
+        out_path = kwargs["out_path"]
+        merge_shards(out_path, len(gpu_ids))
+        if out_path.exists():
+            done = captioned_paths(out_path)
+            videos = [vid for vid in videos if str(vid) not in done]
+
+    torch.multiprocessing.spawn(caption_worker, args=(gpu_ids, videos, kwargs), nprocs=len(gpu_ids))
+
+    if kwargs["fmt"] == "jsonl":
+        merge_shards(kwargs["out_path"], len(gpu_ids))
+
+
 # ─── CLI ────────────────────────────────────────────────────────────────────
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(
@@ -611,8 +1695,24 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--fps", type=float, default=None,
                    help="Frame-sampling FPS (uses raw video if omitted)")
     p.add_argument("--max-pixels", type=int, default=None)
+    p.add_argument("--batch-size", type=int, default=4,
+                   help="Videos per generate call (halved automatically on OOM)")
     p.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    p.add_argument("--quant", choices=["nf4", "int8", "fp8", "none"], default="nf4",
+                   help="Weight-only quantization of the language model "
+                        "(nf4/int8: bitsandbytes, fp8: torchao on sm_89+; "
+                        "without them the model loads unquantized)")
+    p.add_argument("--compile", action="store_true",
+                   help="torch.compile the model forward (CUDA graphs, warm-up cost per shape)")
+    p.add_argument("--skip-blocks", type=float, default=0.0, metavar="FRAC",
+                   help="Fraction of middle decoder blocks to skip (faster, slightly rougher captions)")
+    p.add_argument("--merge-sim", type=float, default=0.0, metavar="SIM",
+                   help="Drop frame pairs at least this similar (0-1) to the last kept pair "
+                        "before encoding - fewer visual tokens on static shots (0 = off). "
+                        "Applies to raw videos, --fps frames and the downscale fallback")
     p.add_argument("--skip-dir", type=Path, default=Path("skipped_videos"))
+    p.add_argument("--num-gpus", type=int, default=1,
+                   help="GPUs to caption on in parallel, one model each (0 = all visible)")
     return p.parse_args()
 
 
@@ -628,15 +1728,25 @@ def main() -> None:
 
     args.skip_dir.mkdir(parents=True, exist_ok=True)
 
-    caption(
-        videos=vids,
+    kwargs = dict(
         out_path=args.output,
         fmt=args.format,
         fps=args.fps,
         max_pixels=args.max_pixels,
         device=args.device,
         skip_dir=args.skip_dir,
+        batch_size=max(1, args.batch_size),
+        quant=args.quant,
+        compile_model=args.compile,
+        skip_blocks=min(max(args.skip_blocks, 0.0), 1.0),
+        merge_sim=args.merge_sim,
     )
+    gpus = torch.cuda.device_count() if args.device.startswith("cuda") else 0
+    num_gpus = min(args.num_gpus or gpus, gpus)
+    if num_gpus > 1:
+        caption_multi_gpu(vids, num_gpus, **kwargs)
+    else:
+        caption(videos=vids, **kwargs)
 
 
 if __name__ == "__main__":
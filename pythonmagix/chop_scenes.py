@@ -11,9 +11,12 @@
 #   python chop_scenes.py input  out  -c 5        # + chunk every scene at 5 s
 #   python chop_scenes.py input  out  -t 20       # raise detection threshold
 #   python chop_scenes.py input  out  --dry-run   # see what would happen
+#   python chop_scenes.py input  out  -j 4        # 4 videos in parallel
+#   python chop_scenes.py input  out  --gpu       # cut detection on the GPU
 #
 # Requirements:
 #   pip install scenedetect[opencv] tqdm
+#   pip install av torch              # optional, for --gpu
 #   # FFmpeg must be in PATH (used for lossless splitting: -c copy)
 # -----------------------------------------------------------------------------
 
@@ -24,8 +27,9 @@ import itertools
 import os
 import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Optional, Sequence
+from typing import Iterator, List, Optional
 
 from tqdm import tqdm
 
@@ -38,8 +42,18 @@ except ImportError as e:  # pragma: no cover
         "    (the [opencv] extra makes detection ~3× faster)\n"
     )
 
+try:  # optional: --gpu cut detection
+    import av
+    import numpy as np
+    import torch
+except ImportError:  # pragma: no cover
+    av = np = torch = None
+
 # ─── Config defaults ───────────────────────────────────────────────────────────
 VIDEO_EXTS = {".mp4", ".mov", ".mkv", ".avi", ".webm", ".flv", ".m4v"}
+_EXTS_NO_DOT = frozenset(ext[1:] for ext in VIDEO_EXTS)
+DETECT_WIDTH = 256   # frames are compared at this width, like PySceneDetect's auto-downscale
+DETECT_BATCH = 256   # frames per GPU transfer
 MAGIX_BANNER = (
     "\033[1m\033[35m✨  Magix Katana engaged — slicing video timelines with zen precision…\033[0m"
 )
@@ -47,10 +61,16 @@ MAGIX_BANNER = (
 # ─── Helpers ───────────────────────────────────────────────────────────────────
 
 
-def iter_videos(root: Path) -> Sequence[Path]:
-    for p in root.rglob("*"):
-        if p.suffix.lower() in VIDEO_EXTS and p.is_file():
-            yield p
+def iter_videos(root: Path) -> Iterator[str]:
+    # scandir walk: DirEntry caches the type, so no Path object or stat per entry
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.rpartition(".")[2].lower() in _EXTS_NO_DOT and entry.is_file():
+                    yield entry.path
 
 
 def fname_safe(stem: str) -> str:
@@ -64,6 +84,7 @@ def run_ffmpeg_split(
     start: float,
     end: Optional[float] = None,
     dry: bool = False,
+    segment_time: Optional[float] = None,
 ):
     cmd = [
         "ffmpeg",
@@ -75,7 +96,11 @@ def run_ffmpeg_split(
     ]
     if end is not None:
         cmd += ["-to", f"{end:.3f}"]
-    cmd += ["-i", str(src), "-c", "copy", "-y", str(dst)]
+    cmd += ["-i", str(src), "-c", "copy"]
+    if segment_time:
+        # `dst` is a %d pattern: the segment muxer writes every chunk in this one pass
+        cmd += ["-f", "segment", "-segment_time", f"{segment_time:.3f}", "-reset_timestamps", "1"]
+    cmd += ["-y", str(dst)]
     if dry:
         print(" ".join(cmd))
         return
@@ -85,6 +110,101 @@ def run_ffmpeg_split(
 # ─── Scene detection & export ─────────────────────────────────────────────────
 
 
+def export_scene(
+    src: Path,
+    scene_path: Path,
+    idx: int,
+    start_s: float,
+    end_s: Optional[float],
+    chunk: Optional[float],
+    dry: bool,
+):
+    """Copy one scene out of `src` - or straight into fixed-length chunks of it."""
+    if chunk:
+        # One stream copy from the source; no intermediate scene file to re-read.
+        # Chunks sit next to the scene (the per-video folder): scene stems repeat
+        # across videos, which are processed concurrently
+        chunk_pattern = scene_path.parent / f"{scene_path.stem}_s{idx:03d}_c%02d.mp4"
+        run_ffmpeg_split(src, chunk_pattern, start_s, end_s, dry=dry, segment_time=chunk)
+    else:
+        run_ffmpeg_split(src, scene_path, start_s, end_s, dry=dry)
+
+
+def rgb_to_hsv(rgb: torch.Tensor) -> torch.Tensor:
+    """(..., 3) RGB 0-255 → HSV on OpenCV's scale (H 0-180, S/V 0-255)."""
+    r, g, b = rgb.unbind(-1)
+    v = rgb.amax(-1)
+    delta = v - rgb.amin(-1)
+    d = delta.clamp(min=1e-6)
+    h = torch.where(v == r, (g - b) / d, torch.where(v == g, 2 + (b - r) / d, 4 + (r - g) / d))
+    h = torch.where(delta > 0, (h * 30) % 180, torch.zeros_like(h))
+    s = torch.where(v > 0, delta * 255 / v.clamp(min=1e-6), torch.zeros_like(v))
+    return torch.stack([h, s, v], dim=-1)
+
+
+def detect_scenes_gpu(path: Path, threshold: float, min_len_frames: int) -> List[tuple]:
+    """ContentDetector's cut rule with the per-frame work batched on the GPU.
+
+    PyAV decodes (threaded, scaled during YUV→RGB), then HSV conversion and the
+    mean |ΔH|,|ΔS|,|ΔV| between neighbouring frames run as a few tensor ops per
+    batch instead of an OpenCV call per frame. Returns [(start_s, end_s), ...]
+    with end_s None for the last scene, or [] when there is no cut.
+    """
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    times: List[float] = []
+    scores: List[float] = []
+    prev = None
+    batch = []
+    size = {}
+
+    def flush():
+        nonlocal prev
+        hsv = rgb_to_hsv(torch.from_numpy(np.stack(batch)).to(device).float())
+        if prev is not None:
+            hsv = torch.cat([prev[None], hsv])
+        scores.extend((hsv[1:] - hsv[:-1]).abs().mean(dim=(1, 2, 3)).tolist())
+        prev = hsv[-1]
+        batch.clear()
+
+    with av.open(str(path)) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        for frame in container.decode(stream):
+            if not size:
+                width = min(DETECT_WIDTH, frame.width)
+                size = {"width": width, "height": max(2, round(frame.height * width / frame.width))}
+            batch.append(frame.to_ndarray(format="rgb24", **size))
+            times.append(frame.time or 0.0)
+            if len(batch) == DETECT_BATCH:
+                flush()
+        if batch:
+            flush()
+
+    # scores[i] compares frame i+1 with frame i
+    cuts, last = [], 0
+    for i, score in enumerate(scores, start=1):
+        if score >= threshold and i - last >= min_len_frames:
+            cuts.append(i)
+            last = i
+    if not cuts:
+        return []
+    bounds = [0.0] + [times[i] for i in cuts]
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def detect_scenes_cpu(path: Path, threshold: int, min_len_frames: int) -> List[tuple]:
+    """PySceneDetect ContentDetector → [(start_s, end_s), ...]; [] when there is no cut."""
+    vmanager = VideoManager([str(path)])
+    smanager = SceneManager()
+    smanager.add_detector(ContentDetector(threshold=threshold, min_scene_len=min_len_frames))
+
+    vmanager.start()
+    smanager.detect_scenes(frame_source=vmanager)
+    scenes = smanager.get_scene_list()
+    vmanager.release()
+    return [(start.get_seconds(), end.get_seconds()) for start, end in scenes]
+
+
 def process_video(
     path: Path,
     out_dir: Path,
@@ -92,6 +212,8 @@ def process_video(
     min_len_frames: int,
     chunk: Optional[float],
     dry: bool,
+    scene_workers: int = 1,
+    gpu: bool = False,
 ):
     rel_root = path.parent
     video_stem = fname_safe(path.stem)
@@ -99,52 +221,24 @@ def process_video(
     video_out_root.mkdir(parents=True, exist_ok=True)
 
     # 1) Detect scenes
-    vmanager = VideoManager([str(path)])
-    smanager = SceneManager()
-    smanager.add_detector(ContentDetector(threshold=threshold, min_scene_len=min_len_frames))
-
-    vmanager.start()
-    smanager.detect_scenes(frame_source=vmanager)
-    scenes = smanager.get_scene_list()
-    vmanager.release()
+    detect = detect_scenes_gpu if gpu else detect_scenes_cpu
+    scenes = detect(path, threshold, min_len_frames)
 
     if not scenes:
         # treat whole video as one scene
-        scenes = [(None, None)]
-
-    # 2) Export scenes using ffmpeg -c copy (fast, lossless)
-    for idx, (start_time, end_time) in enumerate(scenes):
-        start_s = start_time.get_seconds() if start_time else 0.0
-        end_s = end_time.get_seconds() if end_time else None
-        scene_name = f"{idx:04d}.mp4"
-        scene_path = video_out_root / scene_name
-        run_ffmpeg_split(path, scene_path, start_s, end_s, dry=dry)
-
-        # Optional fixed-length chunking
-        if chunk and not dry:
-            dur = (end_s - start_s) if end_s else None
-            if dur is None:
-                # probe duration
-                prob = subprocess.run(
-                    ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of",
-                     "default=noprint_wrappers=1:nokey=1", str(scene_path)],
-                    capture_output=True,
-                    text=True,
-                    check=True,
-                )
-                dur = float(prob.stdout.strip())
-            steps = int(dur // chunk) + (1 if dur % chunk > 0.01 else 0)
-            for j in range(steps):
-                c_start = j * chunk
-                c_end = min(dur, (j + 1) * chunk)
-                # c_name = scene_path.with_name(f"{scene_path.stem}_{j:02d}{scene_path.suffix}")
-
-                chunk_file = out_dir / f"{scene_path.stem}_s{idx:03d}_c{j:02d}.mp4"
-
-                run_ffmpeg_split(scene_path, chunk_file, c_start, c_end, dry=dry)
-            # remove original long scene after slicing
-            if steps > 1:
-                scene_path.unlink(missing_ok=True)
+        scenes = [(0.0, None)]
+
+    # 2) Export scenes using ffmpeg -c copy (fast, lossless). Each scene is an
+    #    independent stream copy, so they run side by side.
+    with ThreadPoolExecutor(max_workers=scene_workers) as pool:
+        futures = []
+        for idx, (start_s, end_s) in enumerate(scenes):
+            scene_path = video_out_root / f"{idx:04d}.mp4"
+            futures.append(pool.submit(
+                export_scene, path, scene_path, idx, start_s, end_s, chunk, dry
+            ))
+        for fut in futures:
+            fut.result()  # re-raise the first ffmpeg failure
 
 
 # ─── CLI ──────────────────────────────────────────────────────────────────────
@@ -167,34 +261,57 @@ def parse_args() -> argparse.Namespace:
         metavar="SECONDS",
         help="If set, further split each scene into fixed-length chunks",
     )
+    p.add_argument("-j", "--jobs", type=int, default=min(os.cpu_count() or 1, 8),
+                   help="Videos processed in parallel (capped to spare the disk)")
+    p.add_argument("--gpu", action="store_true",
+                   help="Detect cuts with PyAV decode + batched torch HSV deltas (CUDA if available)")
     p.add_argument("--dry-run", action="store_true", help="Print commands, do nothing")
     return p.parse_args()
 
 
 # ─── Main ─────────────────────────────────────────────────────────────────────
+def _report(vid: Path, fut) -> None:
+    try:
+        fut.result()
+    except subprocess.CalledProcessError as e:
+        print(f"⚠️  FFmpeg error while processing {vid}: {e}", file=sys.stderr)
+    except Exception as e:
+        print(f"⚠️  Failed on {vid}: {e}", file=sys.stderr)
+
+
 def main() -> None:
     args = parse_args()
     print(MAGIX_BANNER)
-    videos = list(iter_videos(args.input))
+    videos = [Path(p) for p in iter_videos(args.input)]
     if not videos:
         print("⚠️  No videos found. Exiting.")
         return
 
     print(f"🔍  Found {len(videos)} video(s).")
-    for vid in tqdm(videos, desc="Processing"):
-        try:
-            process_video(
+    if args.gpu and torch is None:
+        print("⚠️  --gpu needs PyAV + torch (pip install av torch) - using PySceneDetect")
+        args.gpu = False
+    # Scene detection is CPU-bound Python/OpenCV → one process per video; the
+    # remaining cores go to each video's concurrent ffmpeg stream copies
+    jobs = max(1, min(args.jobs, len(videos)))
+    scene_workers = max(1, (os.cpu_count() or 1) // jobs)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(
+                process_video,
                 vid,
                 args.output,
                 threshold=args.threshold,
                 min_len_frames=args.min_frames,
                 chunk=args.chunk,
                 dry=args.dry_run,
-            )
-        except subprocess.CalledProcessError as e:
-            print(f"⚠️  FFmpeg error while processing {vid}: {e}", file=sys.stderr)
-        except Exception as e:
-            print(f"⚠️  Failed on {vid}: {e}", file=sys.stderr)
+                scene_workers=scene_workers,
+                gpu=args.gpu,
+            ): vid
+            for vid in videos
+        }
+        for fut in tqdm(as_completed(futures), total=len(futures), desc="Processing"):
+            _report(futures[fut], fut)
 
     print("\n\033[32m✅  All done! Clips await at → {}\033[0m".format(args.output))
 
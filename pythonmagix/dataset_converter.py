@@ -29,28 +29,40 @@ from __future__ import annotations
 
 import argparse
 import json
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+READ_WORKERS = 32  # caption reads are tiny + I/O-bound - overlap the syscalls
+_WS = re.compile(r"\s+")
+
+
+def read_caption(caption_file: Path):
+    """Caption collapsed to one line, or None if the file is missing."""
+    try:
+        text = caption_file.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    # One C-level pass collapses newlines and runs of whitespace
+    return _WS.sub(" ", text).strip()
+
 
 def collect_pairs(root: Path, recursive: bool = False):
     """Return a list of (relative_video_path, caption) tuples."""
     pattern = "**/*.mp4" if recursive else "*.mp4"
-    videos = list(root.glob(pattern))
+    videos = sorted(root.glob(pattern))
     pairs: list[tuple[str, str]] = []
 
-    for video in sorted(videos):
-        caption_file = video.with_suffix(".txt")
-        if not caption_file.exists():
-            print(f"⚠️  No caption for {video}, skipping.", file=sys.stderr)
-            continue
-
-        caption = caption_file.read_text(encoding="utf-8").strip()
-        # Collapse multi-line captions to one line
-        caption = " ".join(caption.splitlines()).strip()
+    with ThreadPoolExecutor(READ_WORKERS) as ex:
+        captions = ex.map(read_caption, (v.with_suffix(".txt") for v in videos))
+        for video, caption in zip(videos, captions):
+            if caption is None:
+                print(f"⚠️  No caption for {video}, skipping.", file=sys.stderr)
+                continue
 
-        rel_path = video.relative_to(root).as_posix()  # portable
-        pairs.append((rel_path, caption))
+            rel_path = video.relative_to(root).as_posix()  # portable
+            pairs.append((rel_path, caption))
 
     return pairs
 
@@ -68,12 +80,14 @@ def write_txt(pairs, out_dir: Path):
 def write_json(pairs, out_dir: Path):
     out_dir.mkdir(parents=True, exist_ok=True)
     with (out_dir / "captions.json").open("w", encoding="utf-8") as fp:
-        json.dump(
-            [{"video_path": vp, "caption": cap} for vp, cap in pairs],
-            fp,
-            ensure_ascii=False,
-            indent=2,
-        )
+        # Stream one object per line instead of materializing the whole list
+        fp.write("[")
+        sep = "\n  "
+        for vp, cap in pairs:
+            fp.write(sep)
+            fp.write(json.dumps({"video_path": vp, "caption": cap}, ensure_ascii=False))
+            sep = ",\n  "
+        fp.write("\n]\n")
     print(f"✅ Wrote {len(pairs):,} pairs → captions.json")
 
 
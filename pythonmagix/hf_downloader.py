@@ -20,18 +20,26 @@
 
 from __future__ import annotations
 
+import functools
+import importlib.util
 import json
 import os
+import shutil
 import sys
 import textwrap
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Dict, Optional
 
-try:
+if TYPE_CHECKING:
     import requests
     from tqdm import tqdm
-except ImportError:
+
+# requests + tqdm (~80 ms of imports) load on first use (the first probe or download);
+# only check they're installed now, so a missing one still fails before any questions
+if not all(importlib.util.find_spec(mod) for mod in ("requests", "tqdm")):
     sys.exit(
         "Missing deps! Run:\n  pip install --upgrade requests tqdm\n"
         "…then re‑invoke this script. 🔄✨"
@@ -55,6 +63,64 @@ HEART = "💖"
 # ─── Configuration ────────────────────────────────────────────────────────────
 CONFIG_FILE = Path(__file__).with_name("magix_config.json")
 MODELS_KEY = "comfyui_models_dir"
+HF_HOSTS = {"huggingface.co", "hf.co"}
+
+# Bytes per read; big chunks keep Python's per-chunk overhead off multi-GB checkpoints
+CHUNK_SIZE = int(os.environ.get("HF_DL_CHUNK", 1 << 20))
+# Writes are coalesced into this many bytes per write() syscall, whatever the chunk size
+WRITE_BUFFER = 4 << 20
+# Parallel range requests per file - the CDN caps each connection's bandwidth
+SEGMENTS = max(1, int(os.environ.get("HF_DL_SEGMENTS", 8)))
+# Smaller files aren't worth the extra connections
+MIN_SEGMENTED_SIZE = 64 << 20
+# HF_DL_SYNC=1: make each file durable when it completes and drop it from the page
+# cache, instead of leaving GBs of dirty pages to flush after exit (slow/USB drives)
+SYNC = os.environ.get("HF_DL_SYNC", "") not in ("", "0")
+# Files fetched side by side when several URLs are pasted at once
+PARALLEL_FILES = 4
+# Shared by every progress bar: redraw at most 4×/s (and per MiB), not at all when
+# piped to a log. CDN delivery is bursty, so the rate/ETA average over a long horizon
+BAR_KWARGS = dict(
+    unit="B",
+    unit_scale=True,
+    unit_divisor=1024,
+    bar_format=" {l_bar}{bar} | {n_fmt}/{total_fmt} [{rate_fmt}, ETA {remaining}]{postfix}",
+    mininterval=0.25,
+    miniters=1 << 20,
+    smoothing=0.05,
+    dynamic_ncols=True,
+)
+
+
+def make_session() -> requests.Session:
+    """Keep-alive session: the hf.co → CDN redirect hops reuse pooled TLS connections."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        # Enough kept-alive sockets for every segment of every concurrent file
+        pool_maxsize=max(8, SEGMENTS * PARALLEL_FILES),
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = "magix-hf-downloader"
+    # Checkpoints are already compressed - gzip would only cost a zlib pass per chunk
+    session.headers["Accept-Encoding"] = "identity"
+    return session
+
+
+_SESSION: Optional[requests.Session] = None
+
+
+def get_session() -> requests.Session:
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = make_session()
+    return _SESSION
 
 
 def load_config() -> Dict[str, str]:
@@ -78,9 +144,10 @@ def save_config(cfg: Dict[str, str]) -> None:
 
 # ─── Helpers ──────────────────────────────────────────────────────────────────
 def prompt(text: str, default: Optional[str] = None) -> str:
-    suffix = f" [{default}]" if default else ""
+    # Built once, not on every retry of the loop
+    question = f"{CYAN}{text}{f' [{default}]' if default else ''}{RESET}\n> "
     while True:
-        reply = input(f"{CYAN}{text}{suffix}{RESET}\n> ").strip()
+        reply = input(question).strip()
         if reply:
             return reply
         if default is not None:
@@ -88,9 +155,9 @@ def prompt(text: str, default: Optional[str] = None) -> str:
 
 
 def pick_option(options: list[str], message: str) -> str:
-    print(f"\n{BOLD}{message}{RESET}")
-    for idx, opt in enumerate(options, 1):
-        print(f"  {idx}) {opt}")
+    # One write for the whole menu, however many folders there are
+    menu = "".join(f"  {idx}) {opt}\n" for idx, opt in enumerate(options, 1))
+    sys.stdout.write(f"\n{BOLD}{message}{RESET}\n{menu}")
     while True:
         sel = input("\nEnter number (or 0 to create new): ").strip()
         if sel == "0":
@@ -101,32 +168,309 @@ def pick_option(options: list[str], message: str) -> str:
         print(f"{YELLOW}Invalid choice. Try again.{RESET}")
 
 
-def download(url: str, dest: Path) -> None:
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    print(f"\n{ROCKET} Downloading to {dest} …")
-    with requests.get(url, stream=True, allow_redirects=True) as r:
+def progress_bar(total: int, position: int = 0, initial: int = 0) -> tqdm:
+    from tqdm import tqdm
+
+    return tqdm(
+        total=total, position=position, initial=initial, disable=not sys.stderr.isatty(), **BAR_KWARGS
+    )
+
+
+# (final URL, size, byte ranges served?, ETag)
+Probe = tuple[str, int, bool, Optional[str]]
+
+
+def probe(url: str) -> Probe:
+    """HEAD through the redirects → (final URL, size, byte ranges served?, ETag).
+
+    For LFS files hf.co's own redirect carries X-Linked-Etag (the sha256), which
+    names the content more reliably than whatever ETag the CDN hop sends.
+    """
+    with get_session().head(url, allow_redirects=True) as r:
+        r.raise_for_status()
+        total = int(r.headers.get("content-length", 0))
+        ranges = r.headers.get("accept-ranges", "").lower() == "bytes"
+        linked = [h.headers["x-linked-etag"] for h in r.history if "x-linked-etag" in h.headers]
+        etag = linked[0] if linked else r.headers.get("etag")
+        return r.url, total, ranges, etag
+
+
+def probe_or_default(url: str) -> Probe:
+    """`probe`, or "unknown size, no ranges, no ETag" for hosts that refuse HEAD."""
+    import requests
+
+    try:
+        return probe(url)
+    except requests.RequestException:  # a plain GET still works there
+        return url, 0, False, None
+
+
+def etag_path(dest: Path) -> Path:
+    """ETag of the finished download, to recognise an unchanged file on the next run."""
+    return dest.with_name(dest.name + ".etag")
+
+
+def is_current(dest: Path, total: int, etag: Optional[str]) -> bool:
+    """`dest` is a finished download of exactly this remote file."""
+    if not etag or not total:
+        return False
+    try:
+        return dest.stat().st_size == total and etag_path(dest).read_text(encoding="utf-8") == etag
+    except OSError:
+        return False
+
+
+def preallocate(fd: int, size: int) -> None:
+    """Reserve `size` bytes up front (one contiguous extent where the FS allows)."""
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:  # e.g. filesystems without fallocate support
+            pass
+    os.ftruncate(fd, size)
+
+
+def settle(fd: int) -> None:
+    """With HF_DL_SYNC: one fdatasync for the finished file, then release its cached pages."""
+    if not SYNC:
+        return
+    (os.fdatasync if hasattr(os, "fdatasync") else os.fsync)(fd)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def part_path(dest: Path) -> Path:
+    """Where bytes land until the download is complete."""
+    return dest.with_name(dest.name + ".part")
+
+
+def progress_path(dest: Path) -> Path:
+    """Per-range resume offsets of an interrupted ranged download."""
+    return dest.with_name(dest.name + ".part.json")
+
+
+def load_progress(dest: Path, total: int, etag: Optional[str]) -> Optional[list[list[int]]]:
+    """[[lo, hi, next], ...] left by an interrupted run of the same file version, else None.
+
+    The ETag has to match too: a checkpoint re-uploaded in place at the same size
+    would otherwise get its new bytes spliced onto the old ones.
+    """
+    if not etag or not part_path(dest).exists():
+        return None
+    try:
+        state = json.loads(progress_path(dest).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if state.get("total") != total or state.get("etag") != etag:
+        return None
+    return state["spans"]
+
+
+def save_progress(dest: Path, total: int, etag: Optional[str], spans: list[list[int]]) -> None:
+    progress_path(dest).write_text(
+        json.dumps({"total": total, "etag": etag, "spans": spans}), encoding="utf-8"
+    )
+
+
+def write_at(fd: int, data: bytes, offset: int) -> None:
+    if hasattr(os, "pwrite"):
+        os.pwrite(fd, data, offset)
+    else:  # single range only (see download) - nothing else moves the file offset
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def fetch_stream(url: str, dest: Path, position: int = 0) -> None:
+    """One sequential GET, copied straight from the raw response (no resume)."""
+    from tqdm import tqdm
+
+    part = part_path(dest)
+    with get_session().get(url, stream=True, allow_redirects=True) as r:
         r.raise_for_status()
         total = int(r.headers.get("content-length", 0))
-        with tqdm(
+        # Read the urllib3 response directly - no iter_content generator per chunk
+        r.raw.decode_content = True
+        with part.open("wb", buffering=max(WRITE_BUFFER, CHUNK_SIZE)) as out, tqdm.wrapattr(
+            out,
+            "write",
             total=total,
-            unit="B",
-            unit_scale=True,
-            unit_divisor=1024,
-            bar_format=" {l_bar}{bar} | {n_fmt}/{total_fmt}",
-        ) as bar, dest.open("wb") as f:
-            for chunk in r.iter_content(chunk_size=4096):
-                f.write(chunk)
-                bar.update(len(chunk))
+            position=position,
+            disable=not sys.stderr.isatty(),
+            **BAR_KWARGS,
+        ) as f:
+            if total:
+                # Size known up front: let the FS pick one extent instead of growing it
+                preallocate(out.fileno(), total)
+            # Progress advances inside the wrapped write()
+            shutil.copyfileobj(r.raw, f, CHUNK_SIZE)
+            # Drop any reserved tail a (decoded) body didn't fill
+            out.truncate()
+            settle(out.fileno())
+    os.replace(part, dest)
+
+
+def fetch_ranges(
+    url: str, dest: Path, total: int, segments: int, position: int = 0, etag: Optional[str] = None
+) -> None:
+    """Range GETs (`segments` in parallel), each writing its own slice of a preallocated file.
+
+    Progress per range is saved next to the `.part` file whenever the transfer stops
+    early (error or Ctrl-C), so the next run only fetches the missing bytes.
+    """
+    part = part_path(dest)
+    spans = load_progress(dest, total, etag)
+    resuming = spans is not None
+    if not resuming:
+        step = -(-total // segments)
+        spans = [[lo, min(lo + step, total) - 1, lo] for lo in range(0, total, step)]
+    done = sum(nxt - lo for lo, _, nxt in spans)
+    if done:
+        print(f"{CYAN}↻ Resuming at {done / total:.0%}{RESET}")
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    # O_BINARY: on Windows os.open defaults to text mode and would expand \n to \r\n
+    flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0) | (0 if resuming else os.O_TRUNC)
+    fd = os.open(part, flags, 0o644)
+    try:
+        preallocate(fd, total)
+        with progress_bar(total, position, done) as bar:
+
+            def fetch(span: list[int]) -> None:
+                lo, hi, offset = span
+                if offset > hi:
+                    return
+                headers = {"Range": f"bytes={offset}-{hi}"}
+                with get_session().get(url, headers=headers, stream=True) as r:
+                    r.raise_for_status()
+                    if r.status_code != 206:
+                        raise IOError(f"server ignored range {offset}-{hi}")
+                    while not stop.is_set() and (data := r.raw.read(CHUNK_SIZE)):
+                        write_at(fd, data, offset)
+                        offset += len(data)
+                        span[2] = offset
+                        with lock:
+                            bar.update(len(data))
+                if offset != hi + 1 and not stop.is_set():
+                    raise IOError(f"range {lo}-{hi} ended early at byte {offset}")
+
+            with ThreadPoolExecutor(max_workers=len(spans)) as pool:
+                futures = [pool.submit(fetch, span) for span in spans]
+                try:
+                    for fut in futures:
+                        fut.result()
+                except BaseException:
+                    # Let the other ranges finish their current chunk and stop
+                    stop.set()
+                    raise
+        settle(fd)
+    finally:
+        os.close(fd)
+        if all(nxt > hi for _, hi, nxt in spans):
+            progress_path(dest).unlink(missing_ok=True)
+        else:
+            save_progress(dest, total, etag, spans)
+    os.replace(part, dest)
+
+
+def download(
+    url: str, dest: Path, position: int = 0, probed: Optional[Probe] = None
+) -> None:
+    """Fetch `url` into `dest`; `probed` reuses a `probe_or_default` result already in hand."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    final_url, total, ranges, etag = probed or probe_or_default(url)
+    if is_current(dest, total, etag):
+        print(f"\n{GREEN}{CHECK} {dest.name} is already up-to-date - nothing to fetch.{RESET}")
+        return
+
+    print(f"\n{ROCKET} Downloading to {dest} …")
+    # Until the new file is complete, the old ETag must not vouch for it
+    etag_path(dest).unlink(missing_ok=True)
+    if ranges and total:
+        # Hit the resolved CDN URL directly so each range skips the redirect hop
+        big = total >= MIN_SEGMENTED_SIZE and hasattr(os, "pwrite")
+        fetch_ranges(final_url, dest, total, SEGMENTS if big else 1, position, etag)
+    else:
+        fetch_stream(url, dest, position)
+    if etag:
+        etag_path(dest).write_text(etag, encoding="utf-8")
     print(f"{GREEN}{CHECK} Download complete!{RESET}")
 
 
+def download_many(jobs: list[tuple[str, Path, Optional[Probe]]]) -> Dict[Path, Exception]:
+    """Fetch several files concurrently over the shared session → {dest: error} for failures.
+
+    Each job's probe (None if not probed yet) is handed to `download`, so no URL
+    is HEADed twice.
+    """
+    failed: Dict[Path, Exception] = {}
+    get_session()  # built once here, not raced by the worker threads
+    with ThreadPoolExecutor(max_workers=min(PARALLEL_FILES, len(jobs))) as pool:
+        futures = {
+            pool.submit(download, url, dest, position, probed): dest
+            for position, (url, dest, probed) in enumerate(jobs)
+        }
+        for fut, dest in futures.items():
+            try:
+                fut.result()
+            except Exception as e:
+                failed[dest] = e
+    return failed
+
+
+@functools.lru_cache(maxsize=256)
+def parse_url(url: str) -> urllib.parse.SplitResult:
+    """Each URL is split once, however many helpers look at it."""
+    return urllib.parse.urlsplit(url)
+
+
+def normalize_url(url: str) -> str:
+    """Direct-download form of a Hugging Face URL: …/blob/… file pages → …/resolve/…"""
+    parts = parse_url(url)
+    if parts.hostname in HF_HOSTS and "/blob/" in parts.path:
+        return parts._replace(path=parts.path.replace("/blob/", "/resolve/", 1)).geturl()
+    return url
+
+
 def filename_from_url(url: str) -> str:
-    parsed = urllib.parse.urlparse(url)
-    name = Path(parsed.path).name
-    return name or "downloaded_file"
+    return parse_url(url).path.rpartition("/")[2] or "downloaded_file"
 
 
 # ─── Main Flow ────────────────────────────────────────────────────────────────
+def download_batch(urls: list[str], dest_root: Path) -> None:
+    """Several URLs at once: default filenames, fetched concurrently."""
+    # Unchanged files are no-ops for download(); only ask about ones that would change.
+    # The probe rides along with the job so download() doesn't repeat it
+    jobs = []
+    existing = []
+    for url in urls:
+        dest = dest_root / filename_from_url(url)
+        probed = None
+        if dest.exists():
+            probed = probe_or_default(url)
+            if not is_current(dest, probed[1], probed[3]):
+                existing.append(dest)
+        jobs.append((url, dest, probed))
+    if existing:
+        overwrite = prompt(
+            f"{len(existing)} of these files already exist. Overwrite them? [y/N]", default="n"
+        ).lower() == "y"
+        if not overwrite:
+            jobs = [job for job in jobs if job[1] not in existing]
+            print(f"{YELLOW}Keeping the existing files; {len(jobs)} left to fetch.{RESET}")
+    if not jobs:
+        return
+
+    failed = download_many(jobs)
+    for dest, e in failed.items():
+        print(f"{RED}{WARNING} {dest.name} failed: {e}{RESET}")
+    print(
+        f"\n{MAGENTA}{HEART} {len(jobs) - len(failed)}/{len(jobs)} artefacts landed in:\n"
+        f"   {BOLD}{dest_root}{RESET} {SPARKLE}"
+    )
+
+
 def main() -> None:
     print(
         f"{BOLD}{MAGENTA}{SPARKLE} Magix Hugging Face Downloader {SPARKLE}{RESET}\n"
@@ -153,9 +497,11 @@ def main() -> None:
         models_dir = Path(cfg[MODELS_KEY])
 
     # 2) Choose primary sub‑folder
-    subfolders = sorted(
-        [p.name for p in models_dir.iterdir() if p.is_dir() and not p.name.startswith(".")]
-    )
+    # DirEntry.is_dir() comes from the listing - only symlinked folders need a stat
+    with os.scandir(models_dir) as it:
+        subfolders = sorted(
+            e.name for e in it if e.is_dir() and not e.name.startswith(".")
+        )
     chosen = pick_option(
         subfolders,
         f"Select a sub‑folder under {models_dir} "
@@ -172,8 +518,13 @@ def main() -> None:
         dest_root = dest_root / deeper
         dest_root.mkdir(parents=True, exist_ok=True)
 
-    # 4) Hugging Face URL
-    url = prompt("Paste the direct Hugging Face download URL")
+    # 4) Hugging Face URL(s)
+    pasted = prompt("Paste the direct Hugging Face download URL(s), space-separated")
+    urls = [normalize_url(u) for u in pasted.split()]
+    if len(urls) > 1:
+        download_batch(urls, dest_root)
+        return
+    url = urls[0]
 
     # 5) Optional rename
     default_name = filename_from_url(url)
@@ -182,17 +533,21 @@ def main() -> None:
     )
     target_path = dest_root / new_name
 
+    probed = None
     if target_path.exists():
-        overwrite = prompt(
-            f"{target_path} exists. Overwrite? [y/N]", default="n"
-        ).lower() == "y"
-        if not overwrite:
-            print(f"{RED}Abort to keep your existing file safe. Bye!{RESET}")
-            return
+        # An unchanged file needs no confirmation - download() will leave it alone
+        probed = probe_or_default(url)
+        if not is_current(target_path, probed[1], probed[3]):
+            overwrite = prompt(
+                f"{target_path} exists. Overwrite? [y/N]", default="n"
+            ).lower() == "y"
+            if not overwrite:
+                print(f"{RED}Abort to keep your existing file safe. Bye!{RESET}")
+                return
 
     # 6) Download
     try:
-        download(url, target_path)
+        download(url, target_path, probed=probed)
     except Exception as e:
         print(f"{RED}{WARNING} Download failed: {e}{RESET}")
         return
@@ -208,4 +563,8 @@ if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        print(f"\n{YELLOW}Interrupted. No worries — breathe and try again later.{RESET}")
+        print(
+            f"\n{YELLOW}Interrupted. No worries — breathe and try again later "
+            f"(files served with byte ranges + an ETag, like Hugging Face LFS, resume where "
+            f"they stopped; anything else starts over).{RESET}"
+        )
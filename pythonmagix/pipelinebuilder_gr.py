@@ -17,6 +17,7 @@ Requirements (add this to requirements.txt on HF Spaces):
 
 Optional but recommended on HF Spaces:
     ffmpeg (provided by the runtime) for robust video read/write via imageio/ffmpeg
+    pillow-simd in place of pillow (drop-in; SIMD resize/blend/convert for the image pipelines)
 
 Run locally:
     uvicorn not required; simply: `python app.py`
@@ -28,16 +29,39 @@ import os
 import io
 import json
 import shutil
+import subprocess
 import time
 import zipfile
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Tuple
 
 import gradio as gr
 from PIL import Image, ImageOps, ImageDraw, ImageFont
 import imageio
 
+try:  # optional: decode only the frames that are kept
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:  # optional: keyframe seeking for sparse samples of long videos
+    import av
+except ImportError:
+    av = None
+
+try:  # optional: faster manifest parsing
+    import orjson
+except ImportError:
+    orjson = None
+
+try:  # optional: bundled ffmpeg binary for multithreaded GIF palette encoding
+    import imageio_ffmpeg
+except ImportError:
+    imageio_ffmpeg = None
+
 # -----------------------------
 # Utility helpers
 # -----------------------------
@@ -51,15 +75,31 @@ def _ensure_dir(path: str):
     os.makedirs(path, exist_ok=True)
 
 
+# Step dumps are intermediate artifacts: zlib level 1 is several times faster
+# than Pillow's default 6 for a modestly larger file
+PNG_COMPRESS_LEVEL = 1
+
+
 def pil_to_bytes(img: Image.Image, format: str = "PNG") -> bytes:
     buf = io.BytesIO()
-    img.save(buf, format=format)
+    if format.upper() == "PNG":
+        img.save(buf, format=format, compress_level=PNG_COMPRESS_LEVEL)
+    else:
+        img.save(buf, format=format)
     return buf.getvalue()
 
 
 def save_image(img: Image.Image, path: str):
     _ensure_dir(os.path.dirname(path))
-    img.save(path)
+    if path.lower().endswith(".png"):
+        img.save(path, compress_level=PNG_COMPRESS_LEVEL)
+    else:
+        img.save(path)
+
+
+def _ensure_rgba(im: Image.Image) -> Image.Image:
+    # convert() copies even when the mode already matches; blend() only reads
+    return im if im.mode == "RGBA" else im.convert("RGBA")
 
 
 def save_bytes(data: bytes, path: str):
@@ -68,24 +108,141 @@ def save_bytes(data: bytes, path: str):
         f.write(data)
 
 
-def read_video_frames(path: str, max_frames: int = 32) -> List[Image.Image]:
+def read_video_frames(
+    path: str, max_frames: int = 32, stride: int = 1, spread: bool = False
+) -> List[Image.Image]:
+    """Up to `max_frames` frames, keeping every `stride`-th one.
+
+    With `spread`, the frames are sampled evenly across the whole video instead of
+    taken from its start.
+    """
+    stride = max(1, stride)
+    if spread:
+        if av is not None:
+            frames = _read_frames_seek(path, max_frames)
+            if frames is not None:
+                return frames
+        stride = max(stride, _frame_count(path) // max(1, max_frames))
+    if av is not None:
+        frames = _read_frames_av(path, max_frames, stride)
+        if frames is not None:
+            return frames
+    if cv2 is not None:
+        return _read_frames_cv2(path, max_frames, stride)
     frames = []
     try:
         reader = imageio.get_reader(path)
         for i, frame in enumerate(reader):
-            if i >= max_frames:
+            if len(frames) >= max_frames:
                 break
-            frames.append(Image.fromarray(frame))
+            if i % stride == 0:
+                frames.append(Image.fromarray(frame))
         reader.close()
     except Exception as e:
         print(f"Video read error: {e}")
     return frames
 
 
+def _frame_count(path: str) -> int:
+    if av is not None:
+        try:
+            with av.open(path) as container:
+                return container.streams.video[0].frames or 0
+        except Exception:
+            pass
+    if cv2 is not None:
+        cap = cv2.VideoCapture(path)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        cap.release()
+        return total
+    return 0
+
+
+def _read_frames_av(path: str, max_frames: int, stride: int) -> Optional[List[Image.Image]]:
+    # In-process decode with ffmpeg's frame/slice threads - no subprocess piping
+    # raw frames; RGB conversion is only paid for the frames that are kept
+    try:
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            frames = []
+            for i, frame in enumerate(container.decode(stream)):
+                if len(frames) >= max_frames:
+                    break
+                if i % stride == 0:
+                    frames.append(frame.to_image())
+            return frames
+    except Exception as e:
+        print(f"Video decode error: {e}")
+        return None
+
+
+def _read_frames_seek(path: str, max_frames: int) -> Optional[List[Image.Image]]:
+    """Evenly spaced frames via keyframe seeks; None when the sample isn't sparse enough.
+
+    Each target is reached by seeking to the preceding keyframe and decoding
+    forward to it, so only a GOP's worth of frames is decoded per sample rather
+    than the whole video.
+    """
+    try:
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            total = stream.frames
+            if not total or max_frames * 4 > total:
+                return None  # dense sample: a sequential read decodes less
+            stream.thread_type = "AUTO"
+            start = stream.start_time or 0
+            if stream.duration:
+                duration = stream.duration
+            elif container.duration:
+                duration = int(container.duration / av.time_base / stream.time_base)
+            else:
+                return None
+            frames = []
+            for k in range(max_frames):
+                target = start + duration * k // max_frames
+                container.seek(target, stream=stream)  # lands on the keyframe at/before it
+                for frame in container.decode(stream):
+                    if frame.pts is None or frame.pts >= target:
+                        frames.append(frame.to_image())
+                        break
+            return frames
+    except Exception as e:
+        print(f"Video seek error: {e}")
+        return None
+
+
+def _read_frames_cv2(path: str, max_frames: int, stride: int) -> List[Image.Image]:
+    # grab() only demuxes + decodes; the colour conversion + copy out (retrieve) is
+    # paid just for the frames that are kept
+    frames = []
+    cap = cv2.VideoCapture(path)
+    try:
+        i = 0
+        while len(frames) < max_frames and cap.grab():
+            if i % stride == 0:
+                ok, frame = cap.retrieve()
+                if not ok:
+                    break
+                frames.append(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+            i += 1
+    except Exception as e:
+        print(f"Video read error: {e}")
+    finally:
+        cap.release()
+    return frames
+
+
 def write_gif_from_frames(frames: List[Image.Image], out_path: str, fps: int = 8):
     _ensure_dir(os.path.dirname(out_path))
     if not frames:
         raise ValueError("No frames to write.")
+    if imageio_ffmpeg is not None:
+        try:
+            _write_gif_ffmpeg(frames, out_path, fps)
+            return
+        except Exception as e:
+            print(f"ffmpeg GIF encode failed ({e}); falling back to PIL")
     duration = 1.0 / max(1, fps)
     frames[0].save(
         out_path,
@@ -97,6 +254,33 @@ def write_gif_from_frames(frames: List[Image.Image], out_path: str, fps: int = 8
         format="GIF",
     )
 
+
+def _write_gif_ffmpeg(frames: List[Image.Image], out_path: str, fps: int):
+    # One palette for the whole clip (palettegen) applied with ffmpeg's threaded
+    # filters, instead of PIL quantizing every frame on one thread
+    w, h = frames[0].size
+    cmd = [
+        imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-r", str(max(1, fps)), "-i", "-",
+        "-vf", "split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse",
+        "-loop", "0", out_path,
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    try:
+        try:
+            for frame in frames:
+                if frame.size != (w, h):
+                    frame = frame.resize((w, h))
+                proc.stdin.write(frame.convert("RGB").tobytes())
+        finally:
+            proc.stdin.close()  # EOF - and the fd is released even if this flush fails
+    except BrokenPipeError:
+        pass  # ffmpeg quit early; its exit status below reports it
+    finally:
+        proc.wait()  # always reap, so no ffmpeg is left writing out_path behind the PIL fallback
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {proc.returncode}")
+
 # -----------------------------
 # Pipeline base + registry
 # -----------------------------
@@ -118,6 +302,10 @@ class BasePipeline:
     main_output_type: str  # 'image' | 'video' | 'text'
     params: List[ParamSpec] = field(default_factory=list)
 
+    def __post_init__(self):
+        # Fixed per pipeline; saves rebuilding it from the specs on every run
+        self._param_names = tuple(p.name for p in self.params)
+
     def run(self, main_input: Any, **params) -> Tuple[Any, List[Dict[str, Any]]]:
         """Return (output, steps). Steps is a list of dicts, each may include:
         {
@@ -206,11 +394,24 @@ class ImageBlend(BasePipeline):
             {"label": "Base", "image": main_input},
             {"label": "Overlay (resized)", "image": overlay},
         ]
-        out = Image.blend(main_input.convert("RGBA"), overlay.convert("RGBA"), alpha)
+        out = Image.blend(_ensure_rgba(main_input), _ensure_rgba(overlay), alpha)
         steps.append({"label": f"Blended α={alpha}", "image": out})
         return out, steps
 
 
+# Longest side of the frame previews shown as steps
+THUMB_SIZE = 320
+
+
+def _thumb(im: Image.Image) -> Image.Image:
+    scale = THUMB_SIZE / max(im.size)
+    if scale >= 1:
+        return im
+    size = (max(1, round(im.width * scale)), max(1, round(im.height * scale)))
+    # reducing_gap does a cheap integer box-reduce first, then filters the small image
+    return im.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
 class VideoToGIF(BasePipeline):
     def __init__(self):
         super().__init__(
@@ -220,6 +421,8 @@ class VideoToGIF(BasePipeline):
             params=[
                 ParamSpec("max_frames", "int", default=48, help="Max frames to read"),
                 ParamSpec("fps", "int", default=8, help="GIF FPS"),
+                ParamSpec("spread", "bool", default=True,
+                          help="Sample frames across the whole video instead of its first frames"),
             ],
         )
 
@@ -227,11 +430,12 @@ class VideoToGIF(BasePipeline):
         # main_input is a video file path (from gr.Video)
         max_frames = int(params.get("max_frames", 48))
         fps = int(params.get("fps", 8))
-        frames = read_video_frames(main_input, max_frames=max_frames)
+        spread = bool(params.get("spread", True))
+        frames = read_video_frames(main_input, max_frames=max_frames, spread=spread)
         steps = []
         thumb_steps = []
         for i, f in enumerate(frames[:min(12, len(frames))]):
-            thumb_steps.append({"label": f"Frame {i}", "image": f})
+            thumb_steps.append({"label": f"Frame {i}", "image": _thumb(f)})
         if thumb_steps:
             steps.extend(thumb_steps)
         temp_dir = tempfile.mkdtemp(prefix="pipeline_")
@@ -241,6 +445,15 @@ class VideoToGIF(BasePipeline):
         return out_path, steps
 
 
+@lru_cache(maxsize=64)
+def _get_font(size: int):
+    # truetype() re-reads the TTF and sets up FreeType each call; fonts are immutable, so share them
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except Exception:
+        return ImageFont.load_default()
+
+
 class TextOnImage(BasePipeline):
     def __init__(self):
         super().__init__(
@@ -256,12 +469,9 @@ class TextOnImage(BasePipeline):
     def run(self, main_input: Image.Image, **params):
         caption = str(params.get("caption", "Hello"))
         font_size = int(params.get("font_size", 42))
-        img = main_input.convert("RGBA").copy()
+        img = main_input.convert("RGBA")  # always a new image (a copy when already RGBA), safe to draw on
         draw = ImageDraw.Draw(img)
-        try:
-            font = ImageFont.truetype("DejaVuSans.ttf", font_size)
-        except Exception:
-            font = ImageFont.load_default()
+        font = _get_font(font_size)
         w, h = img.size
         bbox = draw.textbbox((0, 0), caption, font=font)
         tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
@@ -283,28 +493,36 @@ register(TextOnImage())
 # Dynamic UI builders
 # -----------------------------
 
+def _build_image(spec: ParamSpec, label: str, info):
+    if spec.multiple:
+        return gr.File(label=label + " (images)", file_count="multiple", file_types=["image"], interactive=True)
+    return gr.Image(label=label, type="pil", interactive=True)
+
+
+def _build_video(spec: ParamSpec, label: str, info):
+    if spec.multiple:
+        return gr.File(label=label + " (videos)", file_count="multiple", file_types=["video"], interactive=True)
+    return gr.Video(label=label, interactive=True)
+
+
+# ptype -> factory(spec, label, info); components are bound to the Blocks
+# context they are created in, so only the dispatch is shared, not instances
+_BUILDERS = {
+    "int": lambda spec, label, info: gr.Number(label=label, value=spec.default, precision=0, interactive=True, info=info),
+    "float": lambda spec, label, info: gr.Number(label=label, value=spec.default, interactive=True, info=info),
+    "text": lambda spec, label, info: gr.Textbox(label=label, value=spec.default or "", lines=2, interactive=True, info=info),
+    "bool": lambda spec, label, info: gr.Checkbox(label=label, value=bool(spec.default), interactive=True, info=info),
+    "choice": lambda spec, label, info: gr.Dropdown(label=label, choices=spec.choices or [], value=spec.default, interactive=True, info=info),
+    "image": _build_image,
+    "video": _build_video,
+}
+
+
 def build_param_component(spec: ParamSpec):
-    label = spec.name
-    info = spec.help or None
-    if spec.ptype == "int":
-        return gr.Number(label=label, value=spec.default, precision=0, interactive=True, info=info)
-    if spec.ptype == "float":
-        return gr.Number(label=label, value=spec.default, interactive=True, info=info)
-    if spec.ptype == "text":
-        return gr.Textbox(label=label, value=spec.default or "", lines=2, interactive=True, info=info)
-    if spec.ptype == "bool":
-        return gr.Checkbox(label=label, value=bool(spec.default), interactive=True, info=info)
-    if spec.ptype == "choice":
-        return gr.Dropdown(label=label, choices=spec.choices or [], value=spec.default, interactive=True, info=info)
-    if spec.ptype == "image":
-        if spec.multiple:
-            return gr.File(label=label + " (images)", file_count="multiple", file_types=["image"], interactive=True)
-        return gr.Image(label=label, type="pil", interactive=True)
-    if spec.ptype == "video":
-        if spec.multiple:
-            return gr.File(label=label + " (videos)", file_count="multiple", file_types=["video"], interactive=True)
-        return gr.Video(label=label, interactive=True)
-    raise ValueError(f"Unknown ptype {spec.ptype}")
+    builder = _BUILDERS.get(spec.ptype)
+    if builder is None:
+        raise ValueError(f"Unknown ptype {spec.ptype}")
+    return builder(spec, spec.name, spec.help or None)
 
 
 def collect_param_values(param_specs: List[ParamSpec], components: List[Any]) -> Dict[str, Any]:
@@ -319,13 +537,59 @@ def collect_param_values(param_specs: List[ParamSpec], components: List[Any]) ->
 
 MANIFEST_NAME = "manifest.json"
 
-
-def export_run_zip(pipeline_name: str, main_type: str, main_input: Any, params: Dict[str, Any], output: Any, steps: List[Dict[str, Any]]) -> str:
-    tmp_root = tempfile.mkdtemp(prefix="export_")
-    media_dir = os.path.join(tmp_root, "media")
-    steps_dir = os.path.join(tmp_root, "steps")
-    _ensure_dir(media_dir)
-    _ensure_dir(steps_dir)
+# Media is already compressed - deflating it again costs CPU for ~0 bytes saved
+STORED_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp4", ".webm", ".mov", ".mkv", ".avi", ".zip"}
+# Larger than ZipFile.write's 8 KiB reads; keeps multi-GB videos at constant memory
+COPY_CHUNK = 1 << 20
+
+
+def _zip_method(name: str) -> int:
+    return zipfile.ZIP_STORED if os.path.splitext(name)[1].lower() in STORED_EXTS else zipfile.ZIP_DEFLATED
+
+
+def export_run_zip(pipeline_name: str, main_type: str, main_input: Any, params: Dict[str, Any], output: Any, steps: List[Dict[str, Any]],
+                   png_cache: Optional[Dict[int, bytes]] = None) -> str:
+    # Everything is written straight into the archive - no staging tree to copy
+    # into, re-read and delete.
+    # png_cache maps id(image) -> PNG bytes; it must live alongside the images it
+    # describes (e.g. in the run state) so the ids stay valid between exports
+    # Unique per call: concurrent exports in the same second must not share (or
+    # delete) each other's archive
+    fd, zip_path = tempfile.mkstemp(prefix=f"pipeline_run_{int(time.time())}_", suffix=".zip")
+    os.close(fd)
+    z = zipfile.ZipFile(zip_path, "w")
+    used: set = set()
+    images: List[Tuple[str, Image.Image]] = []  # PNG-encoded together at the end
+
+    def arc(folder: str, name: str) -> str:
+        # Same-named inputs/outputs would otherwise become duplicate zip entries
+        stem, ext = os.path.splitext(name)
+        arcname, n = f"{folder}/{name}", 1
+        while arcname in used:
+            arcname, n = f"{folder}/{stem}_{n}{ext}", n + 1
+        used.add(arcname)
+        return arcname
+
+    def put_bytes(arcname: str, data) -> str:
+        z.writestr(arcname, data, compress_type=_zip_method(arcname), compresslevel=1)
+        return arcname
+
+    def put_image(arcname: str, img: Image.Image) -> str:
+        images.append((arcname, img))
+        return arcname
+
+    def put_stream(arcname: str, src) -> str:
+        # No per-entry level here (ZipInfo only exposes it privately): media is
+        # stored anyway, and the odd deflated file param gets zlib's default
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        info.compress_type = _zip_method(arcname)
+        with z.open(info, "w", force_zip64=True) as zf:
+            shutil.copyfileobj(src, zf, length=COPY_CHUNK)
+        return arcname
+
+    def put_file(arcname: str, src: str) -> str:
+        with open(src, "rb") as f:
+            return put_stream(arcname, f)
 
     manifest: Dict[str, Any] = {
         "pipeline": pipeline_name,
@@ -338,132 +602,95 @@ def export_run_zip(pipeline_name: str, main_type: str, main_input: Any, params:
         },
     }
 
-    # Save main input
-    if main_type == "image" and isinstance(main_input, Image.Image):
-        in_name = f"input_{_safe_name(pipeline_name)}.png"
-        in_path = os.path.join(media_dir, in_name)
-        save_image(main_input, in_path)
-        manifest["files"]["main_input"] = os.path.relpath(in_path, tmp_root)
-    elif main_type == "video" and isinstance(main_input, str):
-        in_name = os.path.basename(main_input)
-        in_path = os.path.join(media_dir, in_name)
-        try:
-            shutil.copy2(main_input, in_path)
-        except Exception:
-            # fallback: read bytes
-            save_bytes(open(main_input, "rb").read(), in_path)
-        manifest["files"]["main_input"] = os.path.relpath(in_path, tmp_root)
-    elif main_type == "text":
-        in_name = f"input_{_safe_name(pipeline_name)}.txt"
-        in_path = os.path.join(media_dir, in_name)
-        with open(in_path, "w", encoding="utf-8") as f:
-            f.write(str(main_input))
-        manifest["files"]["main_input"] = os.path.relpath(in_path, tmp_root)
-
-    # Save params (including extra media)
-    params_serialized: Dict[str, Any] = {}
-    for key, val in params.items():
-        if isinstance(val, Image.Image):
-            fname = f"param_{_safe_name(key)}.png"
-            fpath = os.path.join(media_dir, fname)
-            save_image(val, fpath)
-            params_serialized[key] = {"file": os.path.relpath(fpath, tmp_root)}
-        elif isinstance(val, (int, float, str, bool)) or val is None:
-            params_serialized[key] = val
-        elif isinstance(val, list):
-            saved_list = []
-            for i, v in enumerate(val):
-                if hasattr(v, "read"):
-                    # gr.File returns objects with .name/.read sometimes; persist bytes
-                    data = v.read()
-                    fname = f"param_{_safe_name(key)}_{i}"
-                    ext = ".bin"
-                    try:
-                        ext = os.path.splitext(v.name)[1] or ext
-                    except Exception:
-                        pass
-                    fpath = os.path.join(media_dir, fname + ext)
-                    save_bytes(data, fpath)
-                    saved_list.append({"file": os.path.relpath(fpath, tmp_root)})
-                else:
-                    saved_list.append(v)
-            params_serialized[key] = saved_list
-        elif hasattr(val, "name"):
-            # File-like from gradio
-            data = val.read()
-            ext = os.path.splitext(getattr(val, "name", "param.bin"))[1] or ".bin"
-            fpath = os.path.join(media_dir, f"param_{_safe_name(key)}{ext}")
-            save_bytes(data, fpath)
-            params_serialized[key] = {"file": os.path.relpath(fpath, tmp_root)}
-        else:
-            # unknown type: try json
-            try:
-                json.dumps(val)
+    try:
+        # Save main input
+        if main_type == "image" and isinstance(main_input, Image.Image):
+            manifest["files"]["main_input"] = put_image(arc("media", f"input_{_safe_name(pipeline_name)}.png"), main_input)
+        elif main_type == "video" and isinstance(main_input, str):
+            manifest["files"]["main_input"] = put_file(arc("media", os.path.basename(main_input)), main_input)
+        elif main_type == "text":
+            manifest["files"]["main_input"] = put_bytes(arc("media", f"input_{_safe_name(pipeline_name)}.txt"), str(main_input))
+
+        # Save params (including extra media)
+        params_serialized: Dict[str, Any] = {}
+        for key, val in params.items():
+            if isinstance(val, Image.Image):
+                params_serialized[key] = {"file": put_image(arc("media", f"param_{_safe_name(key)}.png"), val)}
+            elif isinstance(val, (int, float, str, bool)) or val is None:
                 params_serialized[key] = val
-            except Exception:
-                params_serialized[key] = str(val)
-    manifest["params"] = params_serialized
-
-    # Save output
-    out_rel = None
-    if isinstance(output, Image.Image):
-        out_path = os.path.join(media_dir, "output.png")
-        save_image(output, out_path)
-        out_rel = os.path.relpath(out_path, tmp_root)
-    elif isinstance(output, str) and os.path.exists(output):
-        out_name = os.path.basename(output)
-        out_path = os.path.join(media_dir, out_name)
-        try:
-            shutil.copy2(output, out_path)
-        except Exception:
-            save_bytes(open(output, "rb").read(), out_path)
-        out_rel = os.path.relpath(out_path, tmp_root)
-    elif isinstance(output, (int, float, str, bool)):
-        out_path = os.path.join(media_dir, "output.txt")
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write(str(output))
-        out_rel = os.path.relpath(out_path, tmp_root)
-    manifest["files"]["output"] = out_rel
-
-    # Save steps
-    for si, s in enumerate(steps):
-        rec = {"label": s.get("label")}
-        if s.get("image") is not None:
-            sp = os.path.join(steps_dir, f"step_{si:03d}.png")
-            save_image(s["image"], sp)
-            rec["image"] = os.path.relpath(sp, tmp_root)
-        if s.get("images"):
-            imgs_rel = []
-            for ii, im in enumerate(s["images"]):
-                sp = os.path.join(steps_dir, f"step_{si:03d}_{ii:02d}.png")
-                save_image(im, sp)
-                imgs_rel.append(os.path.relpath(sp, tmp_root))
-            rec["images"] = imgs_rel
-        if s.get("text") is not None:
-            rec["text"] = s["text"]
-        if s.get("video_path") is not None:
-            v_src = s["video_path"]
-            v_dst = os.path.join(steps_dir, os.path.basename(v_src))
-            try:
-                shutil.copy2(v_src, v_dst)
-            except Exception:
-                save_bytes(open(v_src, "rb").read(), v_dst)
-            rec["video_path"] = os.path.relpath(v_dst, tmp_root)
-        manifest["files"]["steps"].append(rec)
-
-    # Write manifest
-    with open(os.path.join(tmp_root, MANIFEST_NAME), "w", encoding="utf-8") as f:
-        json.dump(manifest, f, indent=2)
-
-    # Zip all
-    zip_path = os.path.join(tempfile.gettempdir(), f"pipeline_run_{int(time.time())}.zip")
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as z:
-        for root, dirs, files in os.walk(tmp_root):
-            for file in files:
-                abspath = os.path.join(root, file)
-                arcname = os.path.relpath(abspath, tmp_root)
-                z.write(abspath, arcname)
-    shutil.rmtree(tmp_root, ignore_errors=True)
+            elif isinstance(val, list):
+                saved_list = []
+                for i, v in enumerate(val):
+                    if hasattr(v, "read"):
+                        # gr.File returns objects with .name/.read sometimes; persist bytes
+                        ext = ".bin"
+                        try:
+                            ext = os.path.splitext(v.name)[1] or ext
+                        except Exception:
+                            pass
+                        saved_list.append({"file": put_stream(arc("media", f"param_{_safe_name(key)}_{i}{ext}"), v)})
+                    else:
+                        saved_list.append(v)
+                params_serialized[key] = saved_list
+            elif hasattr(val, "name"):
+                # File-like from gradio
+                ext = os.path.splitext(getattr(val, "name", "param.bin"))[1] or ".bin"
+                params_serialized[key] = {"file": put_stream(arc("media", f"param_{_safe_name(key)}{ext}"), val)}
+            else:
+                # unknown type: try json
+                try:
+                    json.dumps(val)
+                    params_serialized[key] = val
+                except Exception:
+                    params_serialized[key] = str(val)
+        manifest["params"] = params_serialized
+
+        # Save output
+        out_rel = None
+        if isinstance(output, Image.Image):
+            out_rel = put_image(arc("media", "output.png"), output)
+        elif isinstance(output, str) and os.path.exists(output):
+            out_rel = put_file(arc("media", os.path.basename(output)), output)
+        elif isinstance(output, (int, float, str, bool)):
+            out_rel = put_bytes(arc("media", "output.txt"), str(output))
+        manifest["files"]["output"] = out_rel
+
+        # Save steps
+        for si, s in enumerate(steps):
+            rec = {"label": s.get("label")}
+            if s.get("image") is not None:
+                rec["image"] = put_image(arc("steps", f"step_{si:03d}.png"), s["image"])
+            if s.get("images"):
+                rec["images"] = [
+                    put_image(arc("steps", f"step_{si:03d}_{ii:02d}.png"), im)
+                    for ii, im in enumerate(s["images"])
+                ]
+            if s.get("text") is not None:
+                rec["text"] = s["text"]
+            if s.get("video_path") is not None:
+                v_src = s["video_path"]
+                rec["video_path"] = put_file(arc("steps", os.path.basename(v_src)), v_src)
+            manifest["files"]["steps"].append(rec)
+
+        # Pipelines often reuse one image object (input echoed as the first step,
+        # output as the last), so encode each distinct image once. PNG encoding
+        # (zlib) releases the GIL, so they encode side by side; only this thread
+        # touches the ZipFile
+        cache = {} if png_cache is None else png_cache
+        todo = {id(img): img for _, img in images if id(img) not in cache}
+        if todo:
+            with ThreadPoolExecutor(max_workers=min(len(todo), os.cpu_count() or 1)) as pool:
+                cache.update(zip(todo, pool.map(pil_to_bytes, todo.values())))
+        for arcname, img in images:
+            put_bytes(arcname, cache[id(img)])
+
+        # Write manifest
+        put_bytes(MANIFEST_NAME, json.dumps(manifest, indent=2))
+    except BaseException:
+        z.close()
+        os.remove(zip_path)
+        raise
+    z.close()
     return zip_path
 
 
@@ -474,9 +701,15 @@ def import_run_zip(zip_file: str) -> Tuple[str, Dict[str, Any], Dict[str, Any],
     """
     work_dir = tempfile.mkdtemp(prefix="import_")
     with zipfile.ZipFile(zip_file, "r") as z:
-        z.extractall(work_dir)
-    mani_path = os.path.join(work_dir, MANIFEST_NAME)
-    manifest = json.load(open(mani_path, "r", encoding="utf-8"))
+        # extract() returns the sanitized on-disk path, so the cleanup list needs
+        # no walk over the extracted tree afterwards
+        to_cleanup = []
+        for info in z.infolist():
+            path = z.extract(info, work_dir)
+            if not info.is_dir():
+                to_cleanup.append(path)
+        raw = z.read(MANIFEST_NAME)
+    manifest = orjson.loads(raw) if orjson is not None else json.loads(raw)
 
     pipeline_name = manifest["pipeline"]
     main_type = manifest["main_input_type"]
@@ -491,7 +724,8 @@ def import_run_zip(zip_file: str) -> Tuple[str, Dict[str, Any], Dict[str, Any],
         elif main_type == "video":
             main_payload = mi_abs  # path for gr.Video
         else:
-            main_payload = open(mi_abs, "r", encoding="utf-8").read()
+            with open(mi_abs, "r", encoding="utf-8") as f:
+                main_payload = f.read()
 
     # load params
     params = {}
@@ -517,18 +751,16 @@ def import_run_zip(zip_file: str) -> Tuple[str, Dict[str, Any], Dict[str, Any],
         else:
             params[k] = v
 
-    # For cleanup
-    to_cleanup = []
-    for root, dirs, files in os.walk(work_dir):
-        for f in files:
-            to_cleanup.append(os.path.join(root, f))
-
     return pipeline_name, params, main_payload, main_type, to_cleanup
 
 # -----------------------------
 # Gradio App
 # -----------------------------
 
+# Gradio already runs sync handlers in worker threads, but each event defaults to
+# one at a time; PIL, zlib and ffmpeg release the GIL, so let a few runs overlap
+QUEUE_CONCURRENCY = int(os.environ.get("PIPELINE_CONCURRENCY", "4"))
+
 with gr.Blocks(title="Modular Pipeline Builder") as demo:
     gr.Markdown("""
     # 🧩 Modular Pipeline Builder
@@ -628,11 +860,7 @@ with gr.Blocks(title="Modular Pipeline Builder") as demo:
     )
 
     def _collect_params(pipe_name: str, *vals):
-        specs = REGISTRY[pipe_name].params
-        params = {}
-        for spec, val in zip(specs, vals):
-            params[spec.name] = val
-        return params
+        return dict(zip(REGISTRY[pipe_name]._param_names, vals))
 
     def run_pipeline(pipe_name: str, show_steps: bool, img, vid, txt, *param_vals):
         pipe = REGISTRY[pipe_name]
@@ -719,6 +947,7 @@ with gr.Blocks(title="Modular Pipeline Builder") as demo:
             state["params"],
             state["output"],
             state["steps"],
+            png_cache=state.setdefault("_png_cache", {}),
         )
         return zpath
 
@@ -762,6 +991,8 @@ with gr.Blocks(title="Modular Pipeline Builder") as demo:
         outputs=[import_status, pipeline_dropdown, main_image, main_video, main_text, params_container],
     )
 
+demo.queue(default_concurrency_limit=QUEUE_CONCURRENCY)
+
 
 # For HF Spaces
 if __name__ == "__main__":